@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+One-way chat latency for single messages and for bursts, with the outbound
+queue coalescing writes and with every message written on its own
+(transport.MAX_BATCH = 0). Sender and receiver share one process so both
+ends read the same clock; latency is from send_text to the message event
+leaving the receiver's incoming_queue.
+
+    python bench/bench_burst.py --singles 2000 --burst 10000
+    python bench/bench_burst.py --flush-deadline 50e-6   # cost of holding lone messages
+"""
+import argparse, queue, threading, time
+
+from common import free_port, latency_summary, topology, workdir, write_results
+
+def _receive(events, count, arrivals):
+    for _ in range(count):
+        ev = events.get(timeout=30)
+        while ev.get("type") != "message":
+            ev = events.get(timeout=30)
+        arrivals[int(ev["content"])] = time.perf_counter()
+
+def _measure(transport, peer, events, count, gap):
+    """Send count messages, gap seconds apart (0: as fast as possible); per-message latencies."""
+    from app import metrics
+    metrics.reset()
+    sent, arrivals = [0.0] * count, [0.0] * count
+    receiver = threading.Thread(target=_receive, args=(events, count, arrivals), daemon=True)
+    receiver.start()
+    started = time.perf_counter()
+    for i in range(count):
+        sent[i] = time.perf_counter()
+        transport.send_text(peer, "bench", str(i), wait=False)
+        if gap:
+            time.sleep(gap)
+    receiver.join()
+    elapsed = time.perf_counter() - started
+    writes = sum(c["value"] for c in metrics.snapshot()["counters"] if c["name"] == "socket_writes_total")
+    res = latency_summary([a - s for s, a in zip(sent, arrivals)])
+    res.update({"messages_per_s": round(count / elapsed, 1), "writes": writes})
+    return res
+
+def run(topo, singles=1000, burst=10000, gap=0.001, flush_deadline=None):
+    from app import metrics, transport as tp
+    from app.network import TCPServerThread
+    from app.protocol import PROTO_V2
+    metrics.enable()
+    folder = workdir()
+    results = {}
+    max_batch, deadline = tp.MAX_BATCH, tp.FLUSH_DEADLINE
+    if flush_deadline is not None:
+        tp.FLUSH_DEADLINE = flush_deadline
+    try:
+        for mode, batch in (("coalesced", max_batch), ("per_message", 0)):
+            tp.MAX_BATCH = batch
+            events, stop = queue.Queue(), threading.Event()
+            port = free_port()
+            TCPServerThread({"name": "bench", "port": port}, events, stop, folder).start()
+            time.sleep(0.2)
+            transport = tp.Transport(queue.Queue(), folder)
+            peer = (topo["connect"], port, None)
+            transport.learn(topo["connect"], port, None, PROTO_V2)
+            try:
+                transport.send_text(peer, "bench", "0")  # connect and warm up
+                events.get(timeout=10)
+                results[mode] = {
+                    "single": _measure(transport, peer, events, singles, gap),
+                    f"burst_{burst}": _measure(transport, peer, events, burst, 0),
+                }
+            finally:
+                transport.close()
+                stop.set()
+    finally:
+        tp.MAX_BATCH, tp.FLUSH_DEADLINE = max_batch, deadline
+        metrics.disable()
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--singles', type=int, default=1000)
+    ap.add_argument('--burst', type=int, default=10000)
+    ap.add_argument('--gap', type=float, default=0.001, help='seconds between single messages')
+    ap.add_argument('--flush-deadline', type=float, default=None, help='override transport.FLUSH_DEADLINE')
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    # sender and receiver share the process, so this one always runs on loopback
+    with topology() as topo:
+        res = run(topo, args.singles, args.burst, args.gap, args.flush_deadline)
+    write_results({"burst": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Chat round-trip latency: the driver sends a text message, the receiver
+process echoes it back with send_text to a TCPServerThread in the driver,
+and the time until the echo shows up in the driver's incoming_queue is one
+round trip. Reports p50/p99 per wire format, sent with Transport.send_text
+over its pooled connection.
+
+    python bench/bench_chat.py --messages 2000
+"""
+import argparse, os, queue, threading, time
+
+from common import Receiver, free_port, latency_summary, topology, transport_for, workdir, write_results
+
+def run(topo, messages=1000, warmup=50, wires=('v2', 'legacy')):
+    from app.network import TCPServerThread
+    folder = workdir()
+    results = {}
+    for wire in wires:
+        echo_port = free_port()
+        echoes = queue.Queue()
+        stop = threading.Event()
+        TCPServerThread({"name": "driver", "port": echo_port}, echoes, stop, folder).start()
+        port = free_port()
+        rx = Receiver(port, os.path.join(folder, 'rx'), echo=f"{topo['back']}:{echo_port}", prefix=topo["prefix"])
+        transport = transport_for(topo, port, wire)
+        peer = (topo["connect"], port, None)
+        samples = []
+        try:
+            for i in range(warmup + messages):
+                started = time.perf_counter()
+                transport.send_text(peer, "bench", str(i))
+                while echoes.get(timeout=10).get("type") != "message":
+                    pass
+                if i >= warmup:
+                    samples.append(time.perf_counter() - started)
+        finally:
+            stop.set()
+            transport.close()
+            rx.close()
+        results[wire] = latency_summary(samples)
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--messages', type=int, default=1000)
+    ap.add_argument('--wires', default='v2,legacy', help='any of v2,app1,legacy')
+    ap.add_argument('--netns', action='store_true')
+    ap.add_argument('--netem', default=None)
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    with topology(args.netns, args.netem) as topo:
+        res = run(topo, args.messages, wires=tuple(args.wires.split(',')))
+    write_results({"chat": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
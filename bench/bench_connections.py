@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Concurrent connections: at each level N, N client threads send a text
+message to one TCPServerThread at the same instant. Reports how many were
+delivered, answered busy or failed, and the highest level at which every
+message got through.
+
+    python bench/bench_connections.py --levels 16,64,256,1024
+"""
+import argparse, os, threading, time
+
+from common import Receiver, free_port, topology, workdir, write_results
+
+def _burst(host, port, n):
+    from app.network import PeerBusy, send_text
+    counts = {"ok": 0, "busy": 0, "failed": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(n)
+    def client(i):
+        barrier.wait()
+        try:
+            send_text(host, port, "bench", str(i), retries=0)
+            outcome = "ok"
+        except PeerBusy:
+            outcome = "busy"
+        except Exception:
+            outcome = "failed"
+        with lock:
+            counts[outcome] += 1
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(n)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counts["seconds"] = round(time.perf_counter() - started, 4)
+    return counts
+
+def run(topo, levels, limits=None):
+    port = free_port()
+    rx = Receiver(port, os.path.join(workdir(), 'rx'), limits=limits, prefix=topo["prefix"])
+    results = {"levels": {}}
+    try:
+        for n in levels:
+            results["levels"][str(n)] = _burst(topo["connect"], port, n)
+            time.sleep(0.5)
+    finally:
+        rx.close()
+    clean = [n for n in levels if results["levels"][str(n)]["ok"] == n]
+    results["max_all_delivered"] = max(clean) if clean else 0
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--levels', default='8,32,128,512')
+    ap.add_argument('--netns', action='store_true')
+    ap.add_argument('--netem', default=None)
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    with topology(args.netns, args.netem) as topo:
+        res = run(topo, [int(n) for n in args.levels.split(',')])
+    write_results({"connections": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
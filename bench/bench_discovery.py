@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Discovery convergence: N simulated peers announce themselves with the real
+presence format (make_presence) to a DiscoveryThread on a private loopback
+port, each starting at a random point of the announce interval. Reports
+how long the DiscoveryThread takes to report all of them, and how many
+presence packets per second it can ingest.
+
+    python bench/bench_discovery.py --peers 10,100,500 --interval 1
+"""
+import argparse, queue, random, socket, threading, time
+
+from common import free_port, write_results
+
+def _simulate(port, names, interval, stop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    from app.protocol import make_presence
+    packets = [(random.uniform(0, interval), make_presence([{"name": n, "port": 40000 + i}]))
+               for i, n in enumerate(names)]
+    started = time.perf_counter()
+    rounds = 0
+    while not stop.is_set():
+        for offset, payload in sorted(packets):
+            wait = started + rounds * interval + offset - time.perf_counter()
+            if wait > 0 and stop.wait(wait):
+                return
+            sock.sendto(payload, ('127.0.0.1', port))
+        rounds += 1
+
+def convergence(n, interval):
+    from app.network import DiscoveryThread
+    port = free_port()
+    events = queue.Queue()
+    stop = threading.Event()
+    DiscoveryThread(lambda: [], events, stop, port=port, interval=3600).start()
+    names = {f"peer{i}" for i in range(n)}
+    seen = set()
+    started = time.perf_counter()
+    threading.Thread(target=_simulate, args=(port, sorted(names), interval, stop), daemon=True).start()
+    try:
+        while seen != names:
+            ev = events.get(timeout=interval * 10)
+            seen.update(p["name"] for p in ev.get("profiles", []))
+        return time.perf_counter() - started
+    finally:
+        stop.set()
+
+def ingest_rate(packets=20000):
+    from app.network import DiscoveryThread
+    from app.protocol import make_presence
+    port = free_port()
+    events = queue.Queue()
+    stop = threading.Event()
+    DiscoveryThread(lambda: [], events, stop, port=port, interval=3600).start()
+    payload = make_presence([{"name": "flood", "port": 1}])
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    started = time.perf_counter()
+    for _ in range(packets):
+        sock.sendto(payload, ('127.0.0.1', port))
+    time.sleep(0.5)  # let the receive loop drain the socket buffer
+    stop.set()
+    got = events.qsize()
+    return {"sent": packets, "received": got,
+            "received_per_s": round(got / (time.perf_counter() - started), 1)}
+
+def run(peer_counts, interval):
+    return {
+        "interval_s": interval,
+        "convergence_s": {str(n): round(convergence(n, interval), 4) for n in peer_counts},
+        "ingest": ingest_rate(),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--peers', default='10,100,500')
+    ap.add_argument('--interval', type=float, default=1.0)
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    res = run([int(n) for n in args.peers.split(',')], args.interval)
+    write_results({"discovery": res}, args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Transfers and chat under injected faults: latency, bandwidth caps, stalls
+(what loss and reordering look like above TCP), resets, mid-stream
+disconnects, peers that silently drop off, and corruption. Each scenario
+puts a faultproxy.FaultProxy between Transport and a TCPServerThread on
+localhost, so it needs neither root nor tc.
+
+File scenarios send one file and, like a user would, send it again when
+the sender fails or the receiver reports an error. They record:
+  attempts, seconds     until a complete file was published
+  goodput_MBps          file size over those seconds
+  recovery_seconds      from the fault to the completed retry
+  correct               the published file matches the source
+  leftover_files        temp files or extra copies left in the folder
+Chat scenarios send a stream of messages across a fault and count what
+arrived, what the sender was told failed, and what vanished silently.
+
+    python bench/bench_faults.py --size 16M
+    python bench/bench_faults.py --only reset_mid,corrupt_verify
+"""
+import argparse, hashlib, os, queue, threading, time
+
+from common import format_size, free_port, make_file, parse_size, write_results, workdir
+from faultproxy import FaultProxy
+
+BLACKHOLE_TIMEOUT = 3.0
+
+def file_scenarios(size):
+    half = size // 2
+    return {
+        "clean": ({}, {}),
+        "latency_10ms": ({"latency": 0.01, "jitter": 0.005, "faulty": None}, {}),
+        "rate_20MBps": ({"rate": 20e6, "faulty": None}, {}),
+        "wifi": ({"latency": 0.003, "jitter": 0.01, "stall": 0.02, "stall_s": 0.1, "rate": 30e6,
+                  "faulty": None, "seed": 1}, {}),
+        "reset_mid": ({"reset_after": half}, {}),
+        "disconnect_mid": ({"close_after": half}, {}),
+        # the receiver only notices after io_timeout, shortened to BLACKHOLE_TIMEOUT here
+        "blackhole_mid": ({"blackhole_after": half}, {}),
+        "reset_twice": ({"reset_after": half, "faulty": 2}, {}),
+        "corrupt_plain": ({"corrupt_at": [half]}, {}),
+        "corrupt_verify": ({"corrupt_at": [half]}, {"verify": True}),
+        "reset_compress": ({"reset_after": half // 4}, {"compress": True}),
+    }
+
+def chat_scenarios(messages):
+    # a text header is ~80 bytes; cut the stream about halfway through
+    return {
+        "chat_clean": {},
+        "chat_reset": {"reset_after": 40 * messages},
+        "chat_disconnect": {"close_after": 40 * messages},
+        "chat_blackhole": {"blackhole_after": 40 * messages},
+    }
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _next_event(events, timeout):
+    deadline = time.time() + timeout
+    while True:
+        ev = events.get(timeout=max(0.0, deadline - time.time()))
+        if ev.get("type") in ("file", "conn_error", "message"):
+            return ev
+
+def _server(folder, limits=None):
+    from app.network import TCPServerThread
+    events, stop = queue.Queue(), threading.Event()
+    port = free_port()
+    TCPServerThread({"name": "bench", "port": port}, events, stop, folder, limits).start()
+    time.sleep(0.1)
+    return port, events, stop
+
+def run_file(path, proxy_kw, send_kw, max_attempts=5, timeout=60):
+    from app.protocol import PROTO_V2
+    from app.transport import Transport
+    folder = workdir()
+    limits = {"io_timeout": BLACKHOLE_TIMEOUT} if "blackhole_after" in proxy_kw else None
+    port, events, stop = _server(folder, limits)
+    proxy = FaultProxy(("127.0.0.1", port), **proxy_kw).start()
+    transport = Transport(queue.Queue(), folder)
+    transport.learn("127.0.0.1", proxy.port, None, PROTO_V2)
+    peer = ("127.0.0.1", proxy.port, None)
+    size = os.path.getsize(path)
+    started = time.perf_counter()
+    attempts, done, errors = 0, None, []
+    try:
+        while attempts < max_attempts and done is None:
+            attempts += 1
+            try:
+                transport.send_file(peer, "bench", path, **send_kw)
+            except (OSError, ValueError) as e:
+                errors.append(f"sender: {e}")
+            # the receiver reports every attempt that reached it, complete or not
+            try:
+                ev = _next_event(events, timeout)
+            except queue.Empty:
+                errors.append("receiver: no event")
+                continue
+            if ev["type"] == "file":
+                done = ev
+            else:
+                errors.append(f"receiver: {ev.get('error')}")
+        finished = time.perf_counter()
+    finally:
+        transport.close()
+        proxy.close()
+        stop.set()
+    res = {"attempts": attempts, "errors": errors, "faults": [kind for _, _, kind in proxy.faults]}
+    if done is None:
+        return dict(res, delivered=False)
+    # give a cut-off attempt's handler time to clean up before looking at the folder
+    time.sleep(0.2)
+    names = os.listdir(folder)
+    res.update({
+        "delivered": True,
+        "seconds": round(finished - started, 4),
+        "goodput_MBps": round(size / (finished - started) / 1e6, 3),
+        "correct": _digest(done["path"]) == _digest(path),
+        "leftover_files": len(names) - 1,
+    })
+    if proxy.faults:
+        res["recovery_seconds"] = round(finished - proxy.faults[0][0], 4)
+    return res
+
+def run_chat(proxy_kw, messages=2000, gap=0.0005, timeout=10):
+    from app.protocol import PROTO_V2
+    from app.transport import Transport
+    folder = workdir()
+    port, events, stop = _server(folder)
+    proxy = FaultProxy(("127.0.0.1", port), **proxy_kw).start()
+    transport = Transport(queue.Queue(), folder)
+    transport.learn("127.0.0.1", proxy.port, None, PROTO_V2)
+    peer = ("127.0.0.1", proxy.port, None)
+    arrivals = {}  # message number -> arrival times
+    def receive():
+        while True:
+            try:
+                ev = _next_event(events, timeout)
+            except queue.Empty:
+                return
+            if ev["type"] == "message":
+                arrivals.setdefault(int(ev["content"]), []).append(time.perf_counter())
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    futures = []
+    try:
+        for i in range(messages):
+            futures.append(transport.send_text(peer, "bench", str(i), wait=False))
+            time.sleep(gap)
+        failed = 0
+        for fut in futures:
+            try:
+                fut.result(timeout=timeout)
+            except Exception:
+                failed += 1
+        receiver.join()
+    finally:
+        transport.close()
+        proxy.close()
+        stop.set()
+    res = {
+        "messages": messages,
+        "received": len(arrivals),
+        "duplicates": sum(len(t) - 1 for t in arrivals.values()),
+        "failed": failed,  # the sender was told
+        "lost": messages - len(arrivals) - failed,  # nobody was told
+        "faults": [kind for _, _, kind in proxy.faults],
+    }
+    if proxy.faults:
+        fault_t = proxy.faults[0][0]
+        after = [t[0] for t in arrivals.values() if t[0] > fault_t]
+        if after:
+            res["recovery_seconds"] = round(min(after) - fault_t, 4)
+    return res
+
+def run(size, messages=2000, only=None):
+    folder = workdir()
+    path = make_file(folder, size)
+    results = {"size": format_size(size)}
+    for name, (proxy_kw, send_kw) in file_scenarios(size).items():
+        if not only or name in only:
+            results[name] = run_file(path, proxy_kw, send_kw)
+    for name, proxy_kw in chat_scenarios(messages).items():
+        if not only or name in only:
+            results[name] = run_chat(proxy_kw, messages)
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='16M')
+    ap.add_argument('--messages', type=int, default=2000)
+    ap.add_argument('--only', default=None, help='comma separated scenario names')
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    only = set(args.only.split(',')) if args.only else None
+    res = run(parse_size(args.size), args.messages, only)
+    write_results({"faults": dict(res, topology="loopback proxy")}, args.out)
+
+if __name__ == '__main__':
+    main()
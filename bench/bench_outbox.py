@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Store-and-forward chat through outbox.py.
+
+enqueue: Transport.queue_text while the peer is down, as the GUI calls it;
+per-message latency (what a send costs the caller) and the database size.
+drain: the receiver comes up and discovery announces it; time until every
+queued message arrived, and the rate.
+restart: the sender is closed with messages queued and a new one opens
+the same outbox; they go out once discovery hears the peer.
+reset_mid / blackhole_mid: the flush is cut by faultproxy.FaultProxy,
+the next announcement retries, and the receiver drops what it already had.
+
+Every scenario checks delivery: each message arrived exactly once
+(duplicates counts what reached the chat twice, lost what never did),
+and the outbox ended up empty.
+
+    python bench/bench_outbox.py --messages 50000
+"""
+import argparse, os, queue, statistics, threading, time
+
+from common import free_port, write_results, workdir
+from faultproxy import FaultProxy
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+class _Receiver:
+    """TCPServerThread deduplicating through its own outbox database; counts chat messages."""
+    def __init__(self, folder, port):
+        from app.network import TCPServerThread
+        from app.outbox import Outbox
+        self.events, self.stop = queue.Queue(), threading.Event()
+        self.seen = Outbox(os.path.join(folder, "rx.db"))
+        self.arrivals = {}  # message number -> times it reached the chat
+        self.last = None
+        TCPServerThread({"name": "bench", "port": port}, self.events, self.stop, folder, None, None,
+                        self.seen).start()
+        threading.Thread(target=self._count, daemon=True).start()
+        time.sleep(0.1)
+
+    def _count(self):
+        while not self.stop.is_set():
+            try:
+                ev = self.events.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if ev["type"] == "message":
+                n = int(ev["content"])
+                self.arrivals[n] = self.arrivals.get(n, 0) + 1
+                self.last = time.perf_counter()
+
+    def wait(self, messages, timeout):
+        deadline = time.time() + timeout
+        while len(self.arrivals) < messages and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)  # let duplicates, if any, show up
+        return self.last
+
+    def close(self):
+        self.stop.set()
+        self.seen.close()
+
+def _sender(folder, port, events):
+    from app.outbox import Outbox
+    from app.protocol import PROTO_V2
+    from app.transport import Transport
+    transport = Transport(events, folder, outbox=Outbox(os.path.join(folder, "tx.db")))
+    transport.learn("127.0.0.1", port, None, PROTO_V2)
+    return transport
+
+def _announce(transport, port):
+    from app.protocol import PROTO_V2
+    transport._on_presence({"from": "127.0.0.1", "profiles": [{"port": port, "name": None, "proto": PROTO_V2}]})
+
+def _enqueue(transport, peer, start, count):
+    lat = []
+    for i in range(start, start + count):
+        t = time.perf_counter()
+        transport.queue_text(peer, "bench", str(i))
+        lat.append(time.perf_counter() - t)
+    return lat
+
+def _delivery(rx, transport, peer, messages):
+    return {
+        "received": len(rx.arrivals),
+        "duplicates": sum(n - 1 for n in rx.arrivals.values()),
+        "lost": messages - len(rx.arrivals),
+        "left_in_outbox": transport.outbox.count(peer),
+    }
+
+def _events(events):
+    out = []
+    while True:
+        try:
+            out.append(events.get_nowait()["type"])
+        except queue.Empty:
+            return out
+
+def run_store_and_forward(messages, timeout=120):
+    """enqueue and drain, one scenario: the same messages are queued, then delivered."""
+    folder = workdir()
+    port = free_port()
+    events = queue.Queue()
+    transport = _sender(folder, port, events)
+    peer = ("127.0.0.1", port, None)
+    started = time.perf_counter()
+    lat = sorted(_enqueue(transport, peer, 0, messages))
+    enqueue = {
+        "messages": messages,
+        "seconds": round(time.perf_counter() - started, 4),
+        "p50_us": round(_percentile(lat, 0.5) * 1e6, 1),
+        "p99_us": round(_percentile(lat, 0.99) * 1e6, 1),
+        "max_ms": round(lat[-1] * 1e3, 3),
+        "mean_us": round(statistics.mean(lat) * 1e6, 1),
+        "db_MB": round(sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)
+                           if f.startswith("tx.db")) / 1e6, 3),
+    }
+    rx = _Receiver(folder, port)
+    try:
+        started = time.perf_counter()
+        _announce(transport, port)
+        last = rx.wait(messages, timeout)
+        drain = dict(_delivery(rx, transport, peer, messages), events=sorted(set(_events(events))))
+        if last:
+            drain["seconds"] = round(last - started, 4)
+            drain["msgs_per_s"] = round(len(rx.arrivals) / (last - started), 1)
+    finally:
+        transport.close()
+        transport.outbox.close()
+        rx.close()
+    return {"enqueue": enqueue, "drain": drain}
+
+def run_restart(messages, timeout=120):
+    folder = workdir()
+    port = free_port()
+    transport = _sender(folder, port, queue.Queue())
+    peer = ("127.0.0.1", port, None)
+    _enqueue(transport, peer, 0, messages)
+    transport.close()
+    transport.outbox.close()
+    events = queue.Queue()
+    transport = _sender(folder, port, events)
+    rx = _Receiver(folder, port)
+    try:
+        res = {"waiting_after_restart": transport.outbox.count(peer)}
+        started = time.perf_counter()
+        _announce(transport, port)
+        last = rx.wait(messages, timeout)
+        res.update(_delivery(rx, transport, peer, messages))
+        if last:
+            res["seconds"] = round(last - started, 4)
+    finally:
+        transport.close()
+        transport.outbox.close()
+        rx.close()
+    return res
+
+def run_fault(messages, proxy_kw, timeout=120):
+    """
+    Queue while the peer is down, flush through a proxy that cuts the first
+    connection, announce again. A blackholed flush fails once the hello
+    barrier's reply times out, after the 5 s socket timeout.
+    """
+    from app import metrics
+    folder = workdir()
+    port = free_port()
+    rx = _Receiver(folder, port)
+    metrics.enable()
+    metrics.reset()
+    proxy = FaultProxy(("127.0.0.1", port), **proxy_kw).start()
+    events = queue.Queue()
+    transport = _sender(folder, proxy.port, events)
+    peer = ("127.0.0.1", proxy.port, None)
+    try:
+        transport.unreachable.add(peer)  # queue without flushing, as if the peer had been down
+        _enqueue(transport, peer, 0, messages)
+        started = time.perf_counter()
+        _announce(transport, proxy.port)
+        deadline = time.time() + timeout
+        while transport.outbox.count(peer) and time.time() < deadline:
+            # discovery announces the peer every DISCOVERY_INTERVAL; sooner here
+            time.sleep(0.5)
+            _announce(transport, proxy.port)
+        last = rx.wait(messages, 5)
+        res = dict(_delivery(rx, transport, peer, messages), events=_events(events),
+                   faults=[kind for _, _, kind in proxy.faults])
+        # sent again because the cut lost their acknowledgement, and dropped by the receiver
+        res["redelivered_dropped"] = sum(c["value"] for c in metrics.snapshot()["counters"]
+                                         if c["name"] == "duplicate_messages_total")
+        if last:
+            res["seconds"] = round(last - started, 4)
+    finally:
+        metrics.disable()
+        transport.close()
+        transport.outbox.close()
+        proxy.close()
+        rx.close()
+    return res
+
+def run(messages=50000):
+    # a text line is ~120 bytes with its id; cut the first flush about halfway through
+    cut = 60 * messages
+    return dict(run_store_and_forward(messages), **{
+        "restart": run_restart(messages),
+        "reset_mid": run_fault(messages, {"reset_after": cut}),
+        "blackhole_mid": run_fault(messages, {"blackhole_after": cut}),
+    })
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--messages', type=int, default=50000)
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    write_results({"outbox": dict(run(args.messages), topology="loopback")}, args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Hashed / compressed transfers through pipeline.py.
+
+stage: pipeline.send_file into a local socket that is drained as fast as
+possible, so the number is the read -> hash/compress -> send rate, for 1..N
+workers on each backend. It scales with cores up to the point where reading
+and sending on the calling thread become the limit; on a single-CPU
+machine every worker count lands at about the same rate.
+
+transfer: Transport.send_file to a receiver process, plain bytes vs
+per-chunk SHA-256 ("verify") vs zlib ("compress"), on a compressible and
+an incompressible file. ratio is file bytes per byte on the wire.
+
+    python bench/bench_pipeline.py --size 256M --workers 1,2,4,8
+"""
+import argparse, os, socket, statistics, threading, time
+
+from common import (Receiver, format_size, free_port, make_file, parse_size, topology, transport_for, workdir,
+                    write_results)
+
+def make_text_file(folder, size):
+    """Compressible test file: log-like lines, about 5:1 with zlib level 1."""
+    path = os.path.join(folder, f"bench_text_{format_size(size)}.log")
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    rnd = os.urandom(size // 64 + 1).hex()
+    with open(path, 'wb') as wf:
+        left, i = size, 0
+        while left:
+            line = f"2024-01-01T00:00:{i % 60:02d} worker-{i % 16} request {rnd[i * 8 % len(rnd):][:8]} ok\n"
+            data = line.encode()[:left]
+            wf.write(data)
+            left -= len(data)
+            i += 1
+    return path
+
+def _drain(sock):
+    buf = bytearray(1024 * 1024)
+    while sock.recv_into(buf):
+        pass
+
+def _stage_rate(path, codec, backend, workers, repeat):
+    from app import pipeline
+    rates = []
+    for _ in range(repeat):
+        a, b = socket.socketpair()
+        drain = threading.Thread(target=_drain, args=(b,), daemon=True)
+        drain.start()
+        started = time.perf_counter()
+        sent, _ = pipeline.send_file(a, path, codec, backend=backend, workers=workers)
+        a.close()
+        drain.join()
+        rates.append(sent / (time.perf_counter() - started))
+        b.close()
+    return max(rates)
+
+def run_stage(size, workers, repeat=3, backends=('thread', 'process')):
+    folder = workdir()
+    files = {"text": make_text_file(folder, size), "random": make_file(folder, size)}
+    results = {}
+    for backend in backends:
+        for codec in ('none', 'zlib'):
+            for kind, path in files.items():
+                rows = {}
+                base = None
+                for n in workers:
+                    _stage_rate(path, codec, backend, n, 1)  # start the pool
+                    rate = _stage_rate(path, codec, backend, n, repeat)
+                    base = base or rate
+                    rows[f"workers_{n}"] = {"MBps": round(rate / 1e6, 3), "speedup_ratio": round(rate / base, 3)}
+                results[f"{backend}_{codec}_{kind}"] = rows
+    return results
+
+def run_transfer(topo, size, repeat=3):
+    from app import metrics
+    folder = workdir()
+    files = {"text": make_text_file(folder, size), "random": make_file(folder, size)}
+    port = free_port()
+    rx = Receiver(port, os.path.join(folder, 'rx'), prefix=topo["prefix"])
+    transport = transport_for(topo, port, 'v2')
+    peer = (topo["connect"], port, None)
+    metrics.enable()
+    results = {}
+    try:
+        for mode, kw in (("plain", {}), ("verify", {"verify": True}), ("compress", {"compress": True})):
+            for kind, path in files.items():
+                rates, wire = [], 0
+                for _ in range(repeat):
+                    metrics.reset()
+                    started = time.perf_counter()
+                    transport.send_file(peer, "bench", path, **kw)
+                    done = rx.wait('file')
+                    rates.append(size / (done - started))
+                    wire = sum(c["value"] for c in metrics.snapshot()["counters"] if c["name"] == "bytes_sent_total")
+                results[f"{mode}_{kind}"] = {
+                    "best_MBps": round(max(rates) / 1e6, 3),
+                    "median_MBps": round(statistics.median(rates) / 1e6, 3),
+                    "ratio": round(size / wire, 3) if wire else None,
+                }
+    finally:
+        metrics.disable()
+        transport.close()
+        rx.close()
+    return results
+
+def run(topo, size, workers, repeat=3, backends=('thread', 'process')):
+    return {
+        "size": format_size(size),
+        "stage": run_stage(size, workers, repeat, backends),
+        "transfer": run_transfer(topo, size, repeat),
+    }
+
+def default_workers():
+    cpus = os.cpu_count() or 1
+    return sorted({1, 2, 4, 8, cpus} if cpus > 1 else {1, 2})
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', default='64M')
+    ap.add_argument('--workers', default=None, help='worker counts to try, e.g. 1,2,4,8 (default: up to the CPU count)')
+    ap.add_argument('--backends', default='thread,process')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--netns', action='store_true', help='run the receiver in a network namespace')
+    ap.add_argument('--netem', default=None, help='tc netem spec for the namespace link')
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    workers = [int(n) for n in args.workers.split(',')] if args.workers else default_workers()
+    with topology(args.netns, args.netem) as topo:
+        res = run(topo, parse_size(args.size), workers, args.repeat, tuple(args.backends.split(',')))
+    write_results({"pipeline": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
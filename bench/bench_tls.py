@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Cost of TLS against plaintext on the same receiver, which accepts both:
+file throughput, one-way message latency on a pooled connection, and the
+time to open a connection (plaintext, full TLS handshake, resumed session).
+
+    python bench/bench_tls.py --sizes 16M,256M --messages 1000
+"""
+import argparse, os, queue, statistics, time
+
+from common import (Receiver, format_size, free_port, latency_summary, make_file, parse_size, topology, workdir,
+                    write_results)
+
+def _setup(topo, port, tls, count, resume=True):
+    """Time to open a pooled connection (connect, handshake, hello/ack) and send one message."""
+    from app.protocol import PROTO_V2, encode_text
+    from app.transport import PeerConnection
+    line = encode_text(PROTO_V2, "bench", "x")
+    samples = []
+    for _ in range(count):
+        if tls and not resume:
+            tls.sessions.clear()
+        conn = PeerConnection(topo["connect"], port, None, PROTO_V2, tls)
+        started = time.perf_counter()
+        conn.send(line, "bench").result()
+        samples.append(time.perf_counter() - started)
+        conn.close()
+    return latency_summary(samples)
+
+def run(topo, sizes, messages=500, connections=200, repeat=3):
+    from app.protocol import PROTO_V2
+    from app.tls import TLSContext
+    from app.transport import Transport
+    folder = workdir()
+    rx_home = os.path.join(folder, 'tls_rx')
+    rx_fp = TLSContext(rx_home).fingerprint
+    port = free_port()
+    rx = Receiver(port, os.path.join(folder, 'rx_tls'), prefix=topo["prefix"], tls_home=rx_home)
+    peer = (topo["connect"], port, None)
+    results = {}
+    try:
+        for mode in ("plain", "tls"):
+            tls = TLSContext(os.path.join(folder, 'tls_tx')) if mode == "tls" else None
+            transport = Transport(queue.Queue(), folder, tls=tls)
+            transport.learn(topo["connect"], port, None, PROTO_V2, rx_fp)
+            try:
+                single = {}
+                for size in sizes:
+                    path = make_file(folder, size)
+                    rates = []
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        transport.send_file(peer, "bench", path)
+                        rates.append(size / (rx.wait('file') - started))
+                    single[format_size(size)] = {
+                        "best_MBps": round(max(rates) / 1e6, 3),
+                        "median_MBps": round(statistics.median(rates) / 1e6, 3),
+                    }
+                samples = []
+                for i in range(messages + 20):
+                    started = time.perf_counter()
+                    transport.send_text(peer, "bench", str(i))
+                    done = rx.wait('message')
+                    if i >= 20:
+                        samples.append(done - started)
+                res = {"single_file": single, "message": latency_summary(samples)}
+                if tls:
+                    res["connect_full_handshake"] = _setup(topo, port, tls, connections, resume=False)
+                    res["connect_resumed"] = _setup(topo, port, tls, connections)
+                else:
+                    res["connect"] = _setup(topo, port, None, connections)
+                results[mode] = res
+            finally:
+                transport.close()
+        for size in results["plain"]["single_file"]:
+            plain = results["plain"]["single_file"][size]["best_MBps"]
+            results.setdefault("tls_throughput_ratio", {})[size] = round(
+                results["tls"]["single_file"][size]["best_MBps"] / plain, 3)
+    finally:
+        rx.close()
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='16M,256M')
+    ap.add_argument('--messages', type=int, default=500)
+    ap.add_argument('--connections', type=int, default=200)
+    ap.add_argument('--netns', action='store_true')
+    ap.add_argument('--netem', default=None)
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    with topology(args.netns, args.netem) as topo:
+        res = run(topo, sizes, args.messages, args.connections)
+    write_results({"tls": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
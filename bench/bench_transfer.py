@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+File transfer throughput: single files from 1 KB up to 10 GB, and batches of
+small files, through Transport.send_file -> TCPServerThread, once per wire
+format (lanchat/2, app/1 and legacy headers).
+
+    python bench/bench_transfer.py --sizes 1K,1M,64M,1G --out transfer.json
+"""
+import argparse, os, statistics, time
+
+from common import (Receiver, format_size, free_port, make_file, parse_size, topology, transport_for, workdir,
+                    write_results)
+
+DEFAULT_SIZES = "1K,64K,1M,16M,256M,1G"
+
+def run(topo, sizes, repeat=3, batch_count=200, batch_size=4096, wires=('v2', 'legacy')):
+    folder = workdir()
+    results = {}
+    for wire in wires:
+        port = free_port()
+        rx = Receiver(port, os.path.join(folder, f'rx_{wire}'), prefix=topo["prefix"])
+        transport = transport_for(topo, port, wire)
+        peer = (topo["connect"], port, None)
+        try:
+            single = {}
+            for size in sizes:
+                path = make_file(folder, size)
+                rates = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    transport.send_file(peer, "bench", path)
+                    done = rx.wait('file')
+                    rates.append(size / (done - started))
+                single[format_size(size)] = {
+                    "best_MBps": round(max(rates) / 1e6, 3),
+                    "median_MBps": round(statistics.median(rates) / 1e6, 3),
+                }
+            small = [make_file(folder, batch_size, f"small_{i}.bin") for i in range(batch_count)]
+            started = time.perf_counter()
+            for path in small:
+                transport.send_file(peer, "bench", path)
+            for _ in small:
+                done = rx.wait('file')
+            elapsed = done - started
+            results[wire] = {
+                "single_file": single,
+                "small_batch": {
+                    "files": batch_count,
+                    "file_size": batch_size,
+                    "files_per_s": round(batch_count / elapsed, 2),
+                    "seconds": round(elapsed, 4),
+                },
+            }
+        finally:
+            transport.close()
+            rx.close()
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated, e.g. 1K,1M,10G')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--batch-count', type=int, default=200)
+    ap.add_argument('--batch-size', default='4K')
+    ap.add_argument('--wires', default='v2,legacy', help='any of v2,app1,legacy')
+    ap.add_argument('--netns', action='store_true', help='run the receiver in a network namespace')
+    ap.add_argument('--netem', default=None, help='tc netem spec for the namespace link')
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    with topology(args.netns, args.netem) as topo:
+        res = run(topo, sizes, args.repeat, args.batch_count, parse_size(args.batch_size),
+                  tuple(args.wires.split(',')))
+    write_results({"transfer": dict(res, topology=topo["name"])}, args.out)
+
+if __name__ == '__main__':
+    main()
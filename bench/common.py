@@ -0,0 +1,163 @@
+"""
+Shared helpers for the loopback / network-namespace benchmarks.
+
+Every benchmark drives the real networking code from src/ and returns a
+plain dict; run_all.py collects them into one JSON document that
+compare.py can diff between versions.
+"""
+import contextlib, json, os, platform, queue, socket, subprocess, sys, tempfile, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SRC = os.path.join(ROOT, 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def format_size(n):
+    for unit in ('G', 'M', 'K'):
+        if n >= UNITS[unit] and n % UNITS[unit] == 0:
+            return f"{n // UNITS[unit]}{unit}"
+    return str(n)
+
+def make_file(folder, size, name=None):
+    """Incompressible test file of the given size, written in 1 MiB blocks."""
+    path = os.path.join(folder, name or f"bench_{format_size(size)}.bin")
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    block = os.urandom(min(size, 1024 * 1024))
+    with open(path, 'wb') as wf:
+        left = size
+        while left:
+            n = min(left, len(block))
+            wf.write(block[:n])
+            left -= n
+    return path
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50_ms": round(percentile(ms, 50), 4),
+        "p99_ms": round(percentile(ms, 99), 4),
+        "max_ms": round(max(ms), 4),
+    }
+
+def workdir():
+    return tempfile.mkdtemp(prefix='lanchat_bench_')
+
+def meta():
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                      stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        rev = None
+    return {
+        "git": rev,
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def write_results(results, out):
+    doc = {"meta": meta(), "results": results}
+    if out == '-':
+        print(json.dumps(doc, indent=2))
+    else:
+        with open(out, 'w') as wf:
+            json.dump(doc, wf, indent=2)
+        print(f"results written to {out}")
+    return doc
+
+class Receiver:
+    """
+    bench/receiver.py in a subprocess, optionally inside a network namespace.
+    Events it prints are collected by a reader thread; wait() pops them.
+    """
+    def __init__(self, port, folder, echo=None, limits=None, prefix=(), tls_home=None):
+        cmd = list(prefix) + [sys.executable, os.path.join(HERE, 'receiver.py'),
+                              '--port', str(port), '--dir', folder]
+        if echo:
+            cmd += ['--echo', echo]
+        if limits:
+            cmd += ['--limits', json.dumps(limits)]
+        if tls_home:
+            cmd += ['--tls', tls_home]
+        self.port = port
+        self.events = queue.Queue()
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        threading.Thread(target=self._reader, daemon=True).start()
+        self.wait('ready', timeout=15)
+
+    def _reader(self):
+        for line in self.proc.stdout:
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue
+            self.events.put((time.perf_counter(), ev))
+
+    def wait(self, kind, timeout=600):
+        """Block until an event of the given type arrives; returns its timestamp."""
+        deadline = time.time() + timeout
+        while True:
+            t, ev = self.events.get(timeout=max(0.0, deadline - time.time()))
+            if ev.get('type') == kind:
+                return t
+            if ev.get('type') == 'conn_error':
+                raise RuntimeError(ev.get('error'))
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait(timeout=10)
+
+@contextlib.contextmanager
+def topology(netns=False, netem=None):
+    """
+    Where the receiver runs. Yields a dict with the address the driver
+    connects to, the address the receiver reaches the driver on, and the
+    command prefix that starts a process on the receiver side.
+    """
+    if not netns:
+        yield {"name": "loopback", "connect": "127.0.0.1", "back": "127.0.0.1", "prefix": ()}
+        return
+    from netns import Namespace
+    if not Namespace.available():
+        raise SystemExit("--netns needs root and iproute2")
+    with Namespace(netem=netem) as ns:
+        yield {"name": "netns" + (f" ({netem})" if netem else ""), "connect": ns.peer_ip,
+               "back": ns.host_ip, "prefix": ns.prefix}
+
+# wire formats the benchmarks exercise, by short name
+WIRES = {"v2": "lanchat/2", "app1": "app/1", "legacy": "legacy"}
+
+def transport_for(topo, port, wire):
+    """A Transport that talks the given wire format to the receiver."""
+    from app.transport import Transport
+    transport = Transport(queue.Queue(), workdir())
+    transport.learn(topo["connect"], port, None, WIRES[wire])
+    return transport
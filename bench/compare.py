@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files and flag regressions.
+
+    python bench/compare.py old.json new.json --threshold 10
+
+Every numeric leaf present in both files is compared. Whether higher or
+lower is better is inferred from the leaf's key, by exact name or suffix
+(throughput and rates go up, latencies and durations go down); leaves keyed
+by a size or count, like convergence_s.100, go by their parent's key. Other
+numbers are shown but never flagged. A change from a zero baseline counts
+as infinite, so a count like lost going from 0 to anything is flagged.
+Exits with status 1 if any metric regressed by more than the threshold.
+"""
+import argparse, json, math, re, sys
+
+HIGHER = {'MBps', 'max_all_delivered', 'ok', 'received', 'ratio'}
+HIGHER_SUFFIXES = ('_MBps', '_per_s', '_ratio')
+LOWER = {'seconds', 'convergence_s', 'failed', 'busy', 'writes', 'lost', 'duplicates', 'attempts',
+         'leftover_files', 'left_in_outbox'}
+LOWER_SUFFIXES = ('_ms', '_us', '_seconds')
+DIMENSION = re.compile(r'\d+[KMG]?$')  # keys like "100" peers or "16M" bytes
+
+def _leaves(node, path=()):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            yield from _leaves(v, path + (str(k),))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield path, node
+
+def _direction(path):
+    key = path[-1]
+    if DIMENSION.match(key) and len(path) > 1:
+        key = path[-2]
+    if key in HIGHER or key.endswith(HIGHER_SUFFIXES):
+        return 1
+    if key in LOWER or key.endswith(LOWER_SUFFIXES):
+        return -1
+    return 0
+
+def compare(old, new, threshold):
+    old_leaves = dict(_leaves(old.get("results", {})))
+    rows, regressions = [], 0
+    for path, value in _leaves(new.get("results", {})):
+        if path not in old_leaves:
+            continue
+        before = old_leaves[path]
+        if before:
+            change = (value - before) / before * 100
+        else:
+            change = math.copysign(math.inf, value) if value else 0.0
+        direction = _direction(path)
+        regressed = direction and change * direction < -threshold
+        regressions += bool(regressed)
+        rows.append(('.'.join(path), before, value, change, 'REGRESSION' if regressed else ''))
+    return rows, regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('old')
+    ap.add_argument('new')
+    ap.add_argument('--threshold', type=float, default=10.0, help='percent change tolerated')
+    args = ap.parse_args()
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, regressions = compare(old, new, args.threshold)
+    print(f"{old['meta'].get('git')} -> {new['meta'].get('git')}")
+    for name, before, after, change, flag in rows:
+        print(f"{name:60s} {before:>14.4f} {after:>14.4f} {change:+8.1f}% {flag}")
+    print(f"{regressions} regression(s) above {args.threshold}%")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Fault-injecting TCP proxy for localhost tests; no root, tc or services needed.
+
+FaultProxy listens on a local port and relays every connection it accepts
+to target, applying faults to the byte stream in each direction:
+  latency, jitter  seconds before forwarded data is delivered (jitter is
+                   added uniformly at random, order is kept)
+  rate             bandwidth cap in bytes per second
+  stall, stall_s   probability per forwarded chunk that it, and everything
+                   behind it, is held back stall_s longer. This is how loss
+                   and packet reordering look from above a TCP socket:
+                   retransmission and reassembly stall the stream, bytes
+                   never arrive out of order
+  reset_after      client -> server bytes after which both sides get a RST
+  close_after      client -> server bytes after which both sides are closed
+                   cleanly (FIN), mid-stream
+  blackhole_after  client -> server bytes after which nothing is forwarded
+                   any more in either direction, and nothing is closed: a
+                   peer that dropped off the network
+  corrupt_at       client -> server byte offsets that get one bit flipped
+Only the first `faulty` connections get the faults (None: all of them), so
+a sender that retries can succeed. faults lists (time, connection, kind)
+of every fault that fired, for recovery times.
+
+    with FaultProxy(("127.0.0.1", server_port), latency=0.01, reset_after=1 << 20) as proxy:
+        send_file("127.0.0.1", proxy.port, ...)
+"""
+import random, socket, struct, threading, time
+from collections import deque
+
+READ_SIZE = 64 * 1024
+MAX_QUEUED = 4 * 1024 * 1024  # bytes in flight inside the proxy per direction, so senders feel backpressure
+
+class _Direction:
+    """One direction of a relayed connection: a reader and a writer thread around a delay queue."""
+    def __init__(self, proxy, conn_id, src, dst, upstream, faulty):
+        self.proxy = proxy
+        self.conn_id = conn_id
+        self.src = src
+        self.dst = dst
+        self.upstream = upstream  # client -> server; byte-offset faults count here
+        self.faulty = faulty
+        self.queue = deque()      # (due time, data)
+        self.queued = 0
+        self.offset = 0
+        self.eof = False
+        self.cond = threading.Condition()
+        self.rng = random.Random(proxy.seed)
+
+    def start(self):
+        for target in (self._read_loop, self._write_loop):
+            threading.Thread(target=target, daemon=True).start()
+
+    def _read_loop(self):
+        p = self.proxy
+        try:
+            while True:
+                data = self.src.recv(READ_SIZE)
+                if not data:
+                    break
+                if self.faulty and self.upstream:
+                    data = self._fault(data)
+                    if data is None:
+                        return
+                if self.faulty and p.blackholed(self.conn_id):
+                    continue
+                delay = 0.0
+                if self.faulty:
+                    delay = p.latency + (self.rng.uniform(0, p.jitter) if p.jitter else 0.0)
+                    if p.stall and self.rng.random() < p.stall:
+                        delay += p.stall_s
+                with self.cond:
+                    while self.queued > MAX_QUEUED and not self.eof:
+                        self.cond.wait()
+                    if self.eof:
+                        return
+                    # a held-back chunk holds back everything after it
+                    due = max(time.monotonic() + delay, self.queue[-1][0] if self.queue else 0.0)
+                    self.queue.append((due, data))
+                    self.queued += len(data)
+                    self.cond.notify_all()
+        except OSError:
+            pass
+        if self.faulty and p.blackholed(self.conn_id):
+            return  # not even the FIN gets through
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def _fault(self, data):
+        """Apply byte-offset faults to data about to be forwarded; None once the connection was cut."""
+        p = self.proxy
+        start, end = self.offset, self.offset + len(data)
+        hits = [at - start for at in p.corrupt_at if start <= at < end]
+        if hits:
+            data = bytearray(data)
+            for i in hits:
+                data[i] ^= 0x01
+                p._record(self.conn_id, "corrupt")
+            data = bytes(data)
+        if p.blackhole_after is not None and end > p.blackhole_after:
+            if start <= p.blackhole_after:
+                self._enqueue_now(data[:p.blackhole_after - start])
+                p._record(self.conn_id, "blackhole")
+            self.offset = end
+            return b""
+        for limit, kind in ((p.reset_after, "reset"), (p.close_after, "close")):
+            if limit is not None and end > limit:
+                # forward what came before the cut, then cut
+                self._enqueue_now(data[:max(0, limit - start)])
+                self._drain()
+                p._record(self.conn_id, kind)
+                p._cut(self.conn_id, reset=kind == "reset")
+                return None
+        self.offset = end
+        return data
+
+    def _enqueue_now(self, data):
+        if data:
+            with self.cond:
+                due = self.queue[-1][0] if self.queue else 0.0
+                self.queue.append((due, data))
+                self.queued += len(data)
+                self.cond.notify_all()
+
+    def _drain(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.queue and time.monotonic() < deadline:
+                self.cond.wait(0.05)
+
+    def _write_loop(self):
+        p = self.proxy
+        budget_t = time.monotonic()  # when the rate cap lets the next byte out
+        try:
+            while True:
+                with self.cond:
+                    while not self.queue and not self.eof:
+                        self.cond.wait()
+                    if not self.queue:
+                        break
+                    due, data = self.queue[0]
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(due - now)
+                if self.faulty and p.rate:
+                    budget_t = max(budget_t, time.monotonic()) + len(data) / p.rate
+                    wait = budget_t - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                self.dst.sendall(data)
+                with self.cond:
+                    self.queue.popleft()
+                    self.queued -= len(data)
+                    self.cond.notify_all()
+        except OSError:
+            with self.cond:
+                self.eof = True
+                self.queue.clear()
+                self.cond.notify_all()
+        try:
+            self.dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+class FaultProxy:
+    def __init__(self, target, latency=0.0, jitter=0.0, rate=None, stall=0.0, stall_s=0.2, reset_after=None,
+                 close_after=None, blackhole_after=None, corrupt_at=(), faulty=1, seed=None, host="127.0.0.1"):
+        self.target = target
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.stall = stall
+        self.stall_s = stall_s
+        self.reset_after = reset_after
+        self.close_after = close_after
+        self.blackhole_after = blackhole_after
+        self.corrupt_at = tuple(corrupt_at)
+        self.faulty = faulty
+        self.seed = seed
+        self.faults = []  # (time.perf_counter(), connection number, kind)
+        self.conns = {}   # connection number -> (client socket, server socket)
+        self.accepted = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.port = self.sock.getsockname()[1]
+        self.closed = False
+
+    def start(self):
+        self.sock.listen(64)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while not self.closed:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            try:
+                server = socket.create_connection(self.target, timeout=5)
+            except OSError:
+                client.close()
+                continue
+            server.settimeout(None)
+            for s in (client, server):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.lock:
+                n = self.accepted
+                self.accepted += 1
+                self.conns[n] = (client, server)
+            faulty = self.faulty is None or n < self.faulty
+            _Direction(self, n, client, server, True, faulty).start()
+            _Direction(self, n, server, client, False, faulty).start()
+
+    def blackholed(self, conn_id):
+        with self.lock:
+            return any(n == conn_id and kind == "blackhole" for _, n, kind in self.faults)
+
+    def _record(self, conn_id, kind):
+        with self.lock:
+            self.faults.append((time.perf_counter(), conn_id, kind))
+
+    def _cut(self, conn_id, reset):
+        with self.lock:
+            socks = self.conns.pop(conn_id, ())
+        for s in socks:
+            try:
+                if reset:
+                    # zero linger turns the final close into a RST; SHUT_RD wakes the
+                    # relay thread blocked in recv, which otherwise keeps the socket open
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    s.shutdown(socket.SHUT_RD)
+                else:
+                    s.shutdown(socket.SHUT_RDWR)
+                s.close()
+            except OSError:
+                pass
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        with self.lock:
+            conns = list(self.conns)
+        for n in conns:
+            self._cut(n, reset=False)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
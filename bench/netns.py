@@ -0,0 +1,58 @@
+"""
+Network-namespace topology for benchmarks (Linux, root only).
+
+Creates one namespace connected to the host namespace by a veth pair, so
+traffic crosses a real network stack instead of loopback. An optional tc
+netem spec ("delay 1ms rate 1gbit") shapes the link in both directions.
+
+    with Namespace(netem="delay 2ms") as ns:
+        ns.host_ip, ns.peer_ip, ns.prefix  # prefix runs a command inside
+"""
+import os, shutil, subprocess
+
+class Namespace:
+    def __init__(self, name="lanchat-bench", netem=None, subnet="10.213.7"):
+        self.name = name
+        self.netem = netem
+        self.host_if = f"{name[:9]}-h"
+        self.peer_if = f"{name[:9]}-p"
+        self.host_ip = f"{subnet}.1"
+        self.peer_ip = f"{subnet}.2"
+        self.prefix = ["ip", "netns", "exec", name]
+
+    @staticmethod
+    def available():
+        return hasattr(os, "geteuid") and os.geteuid() == 0 and shutil.which("ip") is not None
+
+    def _run(self, *cmd):
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def __enter__(self):
+        self.teardown()
+        try:
+            self._setup()
+        except Exception:
+            self.teardown()
+            raise
+        return self
+
+    def _setup(self):
+        self._run("ip", "netns", "add", self.name)
+        self._run("ip", "link", "add", self.host_if, "type", "veth", "peer", "name", self.peer_if)
+        self._run("ip", "link", "set", self.peer_if, "netns", self.name)
+        self._run("ip", "addr", "add", f"{self.host_ip}/24", "dev", self.host_if)
+        self._run("ip", "link", "set", self.host_if, "up")
+        self._run(*self.prefix, "ip", "addr", "add", f"{self.peer_ip}/24", "dev", self.peer_if)
+        self._run(*self.prefix, "ip", "link", "set", self.peer_if, "up")
+        self._run(*self.prefix, "ip", "link", "set", "lo", "up")
+        if self.netem:
+            spec = self.netem.split()
+            self._run("tc", "qdisc", "add", "dev", self.host_if, "root", "netem", *spec)
+            self._run(*self.prefix, "tc", "qdisc", "add", "dev", self.peer_if, "root", "netem", *spec)
+
+    def teardown(self):
+        subprocess.run(["ip", "link", "del", self.host_if], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run(["ip", "netns", "del", self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def __exit__(self, *exc):
+        self.teardown()
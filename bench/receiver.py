@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Benchmark receiver process: runs a TCPServerThread, which accepts every
+wire format, and prints one JSON line per received event to stdout, so the
+driver can timestamp completions.
+
+With --echo HOST:PORT every text message is sent straight back, which lets
+the driver measure chat round trips. With --tls HOME the server also accepts
+TLS, using the certificate kept in HOME.
+"""
+import argparse, json, os, queue, sys, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, required=True)
+    ap.add_argument('--dir', required=True)
+    ap.add_argument('--echo', default=None, help='HOST:PORT to echo text messages to')
+    ap.add_argument('--limits', default=None, help='JSON dict overriding TCPServerThread limits')
+    ap.add_argument('--tls', default=None, metavar='HOME', help='accept TLS with the certificate in HOME')
+    args = ap.parse_args()
+
+    incoming = queue.Queue()
+    stop = threading.Event()
+    from app.network import TCPServerThread, send_text
+    limits = json.loads(args.limits) if args.limits else None
+    tls = None
+    if args.tls:
+        from app.tls import TLSContext
+        tls = TLSContext(args.tls)
+    TCPServerThread({"name": "bench", "port": args.port}, incoming, stop, args.dir, limits, tls).start()
+    print(json.dumps({"type": "ready"}), flush=True)
+
+    echo = None
+    if args.echo:
+        host, port = args.echo.rsplit(':', 1)
+        echo = (host, int(port))
+    while True:
+        ev = incoming.get()
+        kind = ev.get("type")
+        if echo and kind == "message":
+            send_text(echo[0], echo[1], "echo", ev.get("content"))
+            continue
+        print(json.dumps({"type": kind, "size": ev.get("size"), "error": ev.get("error")}), flush=True)
+
+if __name__ == '__main__':
+    main()
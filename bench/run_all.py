@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Run every benchmark and write one JSON document.
+
+    python bench/run_all.py --out results-$(git rev-parse --short HEAD).json
+    python bench/run_all.py --quick --out quick.json
+    sudo python bench/run_all.py --netns --netem "delay 1ms rate 1gbit" --out lan.json
+
+Compare two runs with bench/compare.py.
+"""
+import argparse
+
+import bench_burst, bench_chat, bench_connections, bench_discovery, bench_faults, bench_outbox, bench_pipeline
+import bench_tls, bench_transfer
+from common import parse_size, topology, write_results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--quick', action='store_true', help='small sizes and counts, for smoke runs')
+    ap.add_argument('--sizes', default=None, help='transfer sizes, e.g. 1K,1M,1G,10G')
+    ap.add_argument('--netns', action='store_true', help='run receivers in a network namespace')
+    ap.add_argument('--netem', default=None, help='tc netem spec for the namespace link')
+    ap.add_argument('--only', default='transfer,chat,burst,connections,tls,pipeline,faults,outbox,discovery')
+    ap.add_argument('--out', default='-')
+    args = ap.parse_args()
+
+    only = set(args.only.split(','))
+    sizes = args.sizes or ("1K,1M,16M" if args.quick else bench_transfer.DEFAULT_SIZES)
+    results = {}
+    with topology(args.netns, args.netem) as topo:
+        if 'transfer' in only:
+            res = bench_transfer.run(topo, [parse_size(s) for s in sizes.split(',')],
+                                     repeat=1 if args.quick else 3, batch_count=50 if args.quick else 200)
+            results["transfer"] = dict(res, topology=topo["name"])
+        if 'chat' in only:
+            res = bench_chat.run(topo, messages=200 if args.quick else 2000)
+            results["chat"] = dict(res, topology=topo["name"])
+        if 'burst' in only:
+            # sender and receiver share a process here, so this part always runs on loopback
+            with topology() as local:
+                res = bench_burst.run(local, singles=200 if args.quick else 1000, burst=10000)
+            results["burst"] = dict(res, topology=local["name"])
+        if 'connections' in only:
+            levels = [8, 32, 128] if args.quick else [8, 32, 128, 512]
+            results["connections"] = dict(bench_connections.run(topo, levels), topology=topo["name"])
+        if 'tls' in only:
+            res = bench_tls.run(topo, [parse_size(s) for s in ("16M" if args.quick else "16M,256M").split(',')],
+                                messages=200 if args.quick else 1000, connections=50 if args.quick else 200,
+                                repeat=1 if args.quick else 3)
+            results["tls"] = dict(res, topology=topo["name"])
+        if 'pipeline' in only:
+            res = bench_pipeline.run(topo, parse_size("16M" if args.quick else "256M"), bench_pipeline.default_workers(),
+                                     repeat=1 if args.quick else 3)
+            results["pipeline"] = dict(res, topology=topo["name"])
+    if 'faults' in only:
+        # the fault proxy sits on loopback whatever the topology
+        res = bench_faults.run(parse_size("4M" if args.quick else "64M"), messages=500 if args.quick else 2000)
+        results["faults"] = dict(res, topology="loopback proxy")
+    if 'outbox' in only:
+        res = bench_outbox.run(messages=5000 if args.quick else 50000)
+        results["outbox"] = dict(res, topology="loopback")
+    if 'discovery' in only:
+        counts = [10, 100] if args.quick else [10, 100, 500]
+        results["discovery"] = bench_discovery.run(counts, 0.5 if args.quick else 1.0)
+    write_results(results, args.out)
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,15 @@ This GUI polls a thread-safe incoming_queue for network events and updates widge
 import os, queue, threading, time
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton,
                                QListWidget, QTextEdit, QLineEdit, QLabel, QVBoxLayout,
-                               QHBoxLayout, QFileDialog, QMessageBox, QSplitter)
+                               QHBoxLayout, QFileDialog, QMessageBox, QSplitter, QCheckBox)
 from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QDragEnterEvent, QDropEvent
-from .network import DiscoveryThread, TCPServerThread, send_text, send_file
+from .transport import Transport
+from .protocol import SHARED_PORT, PROTO_V2
+from . import metrics, tls
+from .swarm import send_swarm, STALL_TIMEOUT
+from .outbox import Outbox
+from .preview_view import InlinePreviews
 from .utils import get_local_ip
 
 RECV_FOLDER = os.path.join(os.path.expanduser("~"), "LANChat_Received")
@@ -21,21 +26,26 @@ class ChatMainWindow(QMainWindow):
 
         # Shared event queue
         self.incoming_queue = queue.Queue()
+        metrics.gauge_fn("incoming_queue_depth", self.incoming_queue.qsize)
+        self.metrics_server = metrics.serve_from_env()
 
         # Profiles data
         self.profiles = []  # list of dicts {name, port, server_thread, stop_event}
         self.profile_lock = threading.Lock()
         self.current_profile = None
 
-        # Discovered peers: mapping (ip,port) -> {"name":..., "last_seen":ts}
+        # Discovery, listeners and outgoing connections; messages go through the outbox
+        self.outbox = Outbox()
+        metrics.gauge_fn("outbox_pending", self.outbox.count)
+        self.transport = Transport(self.incoming_queue, RECV_FOLDER, tls=tls.from_env(), outbox=self.outbox)
+
+        # Discovered peers: mapping (ip,port,name) -> {"name":..., "last_seen":ts}
         self.peers = {}
 
         self._build_ui()
 
-        # Start discovery thread (shares a callable to get current profiles)
-        self.discovery_stop = threading.Event()
-        self.discovery = DiscoveryThread(self._profiles_snapshot, self.incoming_queue, self.discovery_stop)
-        self.discovery.start()
+        # Start discovery (shares a callable to get current profiles)
+        self.transport.start_discovery(self._profiles_snapshot)
 
         # Timer to poll incoming queue
         self.timer = QTimer()
@@ -57,6 +67,8 @@ class ChatMainWindow(QMainWindow):
         form_h.addWidget(self.name_input)
         form_h.addWidget(self.port_input)
         l_layout.addLayout(form_h)
+        self.shared_check = QCheckBox(f"Shared port ({SHARED_PORT})")
+        l_layout.addWidget(self.shared_check)
         btn_h = QHBoxLayout()
         self.create_btn = QPushButton("Create Profile")
         self.create_btn.clicked.connect(self.create_profile)
@@ -85,6 +97,8 @@ class ChatMainWindow(QMainWindow):
         self.chat_view.setAcceptDrops(True)
         self.chat_view.installEventFilter(self)
         r_layout.addWidget(self.chat_view)
+        # thumbnails of received files, generated off the GUI thread
+        self.previews = InlinePreviews(self.chat_view)
         send_h = QHBoxLayout()
         self.msg_input = QLineEdit()
         send_h.addWidget(self.msg_input)
@@ -94,6 +108,9 @@ class ChatMainWindow(QMainWindow):
         self.attach_btn = QPushButton("Attach & Send")
         self.attach_btn.clicked.connect(self._on_attach)
         send_h.addWidget(self.attach_btn)
+        self.broadcast_btn = QPushButton("Send File to All")
+        self.broadcast_btn.clicked.connect(self._on_broadcast)
+        send_h.addWidget(self.broadcast_btn)
         r_layout.addLayout(send_h)
 
         splitter = QSplitter(Qt.Horizontal)
@@ -112,25 +129,30 @@ class ChatMainWindow(QMainWindow):
         Return list of profiles (name,port) for discovery to broadcast.
         """
         with self.profile_lock:
-            return [{"name":p["name"], "port":p["port"]} for p in self.profiles]
+            return [{"name":p["name"], "port":p["port"], "shared":p.get("shared", False)} for p in self.profiles]
 
     def create_profile(self):
         name = self.name_input.text().strip()
         port_text = self.port_input.text().strip()
-        if not name or not port_text:
+        shared = self.shared_check.isChecked()
+        if not name or not (port_text or shared):
             QMessageBox.warning(self, "Missing", "Please enter profile name and port.")
             return
-        try:
-            port = int(port_text)
-        except ValueError:
-            QMessageBox.warning(self, "Invalid", "Port must be a number.")
-            return
-        # spawn TCP server for this profile
-        stop_event = threading.Event()
-        profile = {"name": name, "port": port, "stop": stop_event, "server": None}
-        server = TCPServerThread(profile, self.incoming_queue, stop_event, RECV_FOLDER)
-        profile["server"] = server
-        server.start()
+        if shared:
+            with self.profile_lock:
+                taken = any(p["name"] == name and p.get("shared") for p in self.profiles)
+            if taken:
+                QMessageBox.warning(self, "Duplicate", "A shared-port profile with this name already exists.")
+                return
+            port = SHARED_PORT
+        else:
+            try:
+                port = int(port_text)
+            except ValueError:
+                QMessageBox.warning(self, "Invalid", "Port must be a number.")
+                return
+        # start receiving for this profile (own TCP server or the shared listener)
+        profile = self.transport.add_profile({"name": name, "port": port}, shared=shared, shared_port=SHARED_PORT)
         with self.profile_lock:
             self.profiles.append(profile)
         self.profile_list.addItem(f"{name} : {port}")
@@ -152,15 +174,7 @@ class ChatMainWindow(QMainWindow):
                     to_remove = p
                     break
             if to_remove:
-                to_remove["stop"].set()
-                try:
-                    # close server socket by connecting to it
-                    import socket
-                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    s.connect(("127.0.0.1", int(to_remove["port"])))
-                    s.close()
-                except Exception:
-                    pass
+                self.transport.remove_profile(to_remove)
                 self.profiles.remove(to_remove)
         self.profile_list.takeItem(self.profile_list.row(sel))
         self._log(f"Removed profile {name}:{port}")
@@ -168,7 +182,7 @@ class ChatMainWindow(QMainWindow):
     def refresh_peers(self):
         self.peer_list.clear()
         for k,v in list(self.peers.items()):
-            ip, port = k
+            ip, port, _ = k
             self.peer_list.addItem(f"{v.get('name')} @ {ip}:{port}")
 
     def _on_profile_selected(self, item):
@@ -202,19 +216,21 @@ class ChatMainWindow(QMainWindow):
         try:
             # expected "Name @ ip:port"
             parts = txt.split("@")
+            to_name = parts[0].strip()
             ipport = parts[1].strip()
             ip, port = ipport.split(":")
         except Exception:
             QMessageBox.warning(self, "Parse error", "Cannot parse selected peer address.")
             return
         # perform send in background
-        threading.Thread(target=self._do_send_text, args=(ip.strip(), int(port.strip()), self.current_profile, text), daemon=True).start()
+        threading.Thread(target=self._do_send_text, args=(ip.strip(), int(port.strip()), self.current_profile, text, to_name), daemon=True).start()
         self.chat_view.append(f"[me:{self.current_profile['name']}] {text}")
         self.msg_input.clear()
 
-    def _do_send_text(self, ip, port, profile, text):
+    def _do_send_text(self, ip, port, profile, text, to_name=None):
+        # stored before sending; delivery is reported through "queued"/"delivered" events
         try:
-            send_text(ip, port, profile["name"], text)
+            self.transport.queue_text((ip, port, to_name), profile["name"], text)
         except Exception as e:
             self._log(f"Send failed: {e}")
 
@@ -234,18 +250,49 @@ class ChatMainWindow(QMainWindow):
         ipport = parts[1].strip()
         ip, port = ipport.split(":")
         # start sending in background
-        threading.Thread(target=self._do_send_file, args=(ip.strip(), int(port.strip()), self.current_profile, fname), daemon=True).start()
+        threading.Thread(target=self._do_send_file, args=(ip.strip(), int(port.strip()), self.current_profile, fname, parts[0].strip()), daemon=True).start()
         self.chat_view.append(f"[file sent from {self.current_profile['name']}] {os.path.basename(fname)}")
 
-    def _do_send_file(self, ip, port, profile, file_path):
+    def _do_send_file(self, ip, port, profile, file_path, to_name=None):
         def progress(sent, total):
             # could update a GUI progress bar via queue
             pass
         try:
-            send_file(ip, port, profile["name"], file_path, progress_callback=progress)
+            self.transport.send_file((ip, port, to_name), profile["name"], file_path, progress_callback=progress)
         except Exception as e:
             self._log(f"File send failed: {e}")
 
+    def _on_broadcast(self):
+        if not self.current_profile:
+            QMessageBox.warning(self, "Select profile", "Choose which local profile will send the file.")
+            return
+        local_ip = get_local_ip()
+        own = {str(p["port"]) for p in self._profiles_snapshot()}
+        peers = [(ip, int(port), name) for ip, port, name in self.peers if not (ip == local_ip and port in own)]
+        # older clients accept the connection but ignore the offer
+        older = [p for p in peers if self.transport.proto_for(*p) != PROTO_V2]
+        peers = [p for p in peers if p not in older]
+        for ip, port, name in older:
+            self._log(f"Skipping {name or ip}@{ip}:{port}: its client is too old for distribution")
+        if not peers:
+            QMessageBox.warning(self, "No peers", "No peers that can receive a distributed file.")
+            return
+        fname, _ = QFileDialog.getOpenFileName(self, "Choose file to distribute")
+        if not fname:
+            return
+        threading.Thread(target=self._do_broadcast, args=(peers, self.current_profile, fname), daemon=True).start()
+        self.chat_view.append(f"[file distributed from {self.current_profile['name']} to {len(peers)} peers] {os.path.basename(fname)}")
+
+    def _do_broadcast(self, peers, profile, file_path):
+        # receivers re-serve pieces to each other; we only seed from our own port
+        try:
+            seed = send_swarm(peers, profile["name"], file_path, profile["port"], tls=self.transport.tls)
+            seed.wait(stall=STALL_TIMEOUT)
+            for (ip, port, name), error in seed.failed.items():
+                self._log(f"{os.path.basename(file_path)} did not reach {name or ip}@{ip}:{port}: {error}")
+        except Exception as e:
+            self._log(f"Distribution failed: {e}")
+
     def eventFilter(self, obj, event):
         # simple drag-and-drop: if files dropped onto chat_view, send them
         if obj == self.chat_view and event.type() == event.Drop:
@@ -259,7 +306,7 @@ class ChatMainWindow(QMainWindow):
                         parts = txt.split("@")
                         ipport = parts[1].strip()
                         ip, port = ipport.split(":")
-                        threading.Thread(target=self._do_send_file, args=(ip.strip(), int(port.strip()), self.current_profile, path), daemon=True).start()
+                        threading.Thread(target=self._do_send_file, args=(ip.strip(), int(port.strip()), self.current_profile, path, parts[0].strip()), daemon=True).start()
                         self.chat_view.append(f"[file sent from {self.current_profile['name']}] {os.path.basename(path)}")
                 return True
         return super().eventFilter(obj, event)
@@ -276,7 +323,7 @@ class ChatMainWindow(QMainWindow):
                     # update peers list
                     from_ip = ev["from"]
                     for p in ev["profiles"]:
-                        key = (from_ip, str(p["port"]))
+                        key = (from_ip, str(p["port"]), p.get("name","?"))
                         self.peers[key] = {"name": p.get("name","?"), "last_seen": time.time()}
                     self.refresh_peers()
                 elif ev["type"] == "message":
@@ -285,10 +332,20 @@ class ChatMainWindow(QMainWindow):
                     # show file received notification and path
                     msg = f"File received from {ev.get('from')}: {ev.get('filename')} -> saved to {ev.get('path')}"
                     self.chat_view.append(msg)
+                    self.previews.add(ev.get("path"))
                 elif ev["type"] == "server_error":
                     self._log(f"Server error for {ev.get('profile')}: {ev.get('error')}")
                 elif ev["type"] == "conn_error":
                     self._log(f"Connection error: {ev.get('error')}")
+                elif ev["type"] == "tls_mismatch":
+                    self._log(f"Refusing {ev.get('from')}: {ev.get('error')}")
+                elif ev["type"] == "queued":
+                    ip, port, name = ev["peer"]
+                    self._log(f"{name or ip}@{ip}:{port} unreachable ({ev.get('error')}); "
+                              f"{ev.get('pending')} message(s) will be sent when it is back")
+                elif ev["type"] == "delivered" and ev.get("backlog"):
+                    ip, port, name = ev["peer"]
+                    self._log(f"Delivered {ev['count']} queued message(s) to {name or ip}@{ip}:{port}")
             except Exception as e:
                 print("Error handling event:", e)
 
@@ -297,8 +354,10 @@ class ChatMainWindow(QMainWindow):
 
     def closeEvent(self, event):
         # cleanup threads
-        self.discovery_stop.set()
         with self.profile_lock:
             for p in list(self.profiles):
                 p["stop"].set()
+        self.transport.close()
+        self.outbox.close()
+        self.previews.shutdown()
         super().closeEvent(event)
\ No newline at end of file
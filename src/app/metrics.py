@@ -0,0 +1,208 @@
+"""
+Lightweight counters, gauges and histograms for the network hot paths.
+
+Recording is disabled by default: every helper returns after checking one
+module flag, so instrumented code costs next to nothing until enable() is
+called. Values can be exported as Prometheus text (serve() exposes /metrics
+on localhost) or as a JSON snapshot (/metrics.json or snapshot()).
+"""
+import json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = False
+PREFIX = "lanchat_"
+
+# histogram bucket upper bounds, per metric name
+BUCKETS = {
+    "connect_seconds": (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0),
+    "transfer_throughput_bytes_per_second": (1e5, 1e6, 1e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9, 1e10),
+    "send_batch_messages": (1, 2, 4, 16, 64, 256, 1024, 4096),
+}
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+HELP = {
+    "bytes_sent_total": "Payload and header bytes written to peers",
+    "bytes_received_total": "Payload and header bytes read from peers",
+    "messages_sent_total": "Messages and file headers sent",
+    "messages_received_total": "Messages and file headers received",
+    "connect_seconds": "Time to establish an outgoing TCP connection",
+    "transfer_throughput_bytes_per_second": "Throughput of completed file transfers",
+    "active_connections": "Incoming connections currently being handled",
+    "idle_connections": "Persistent incoming connections waiting for their next message, off the handler pool",
+    "incoming_queue_depth": "Events waiting in the GUI incoming_queue",
+    "threads": "Live Python threads",
+    "discovery_packets_total": "Discovery datagrams sent and received",
+    "busy_rejections_total": "Connections or transfers answered with busy",
+    "errors_total": "Errors caught on network paths",
+    "tls_handshakes_total": "TLS handshakes, by side and whether the session was resumed",
+    "send_batch_messages": "Chat messages coalesced into one write",
+    "socket_writes_total": "Write syscalls issued for queued chat messages",
+    "duplicate_messages_total": "Redelivered queued messages dropped by id",
+    "outbox_delivered_total": "Queued messages acknowledged by their peer",
+    "outbox_pending": "Messages waiting in the outbox",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_gauges = {}      # (name, labels) -> value
+_gauge_fns = {}   # name -> callable sampled at export time
+_histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def gauge_add(name, delta, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def gauge_fn(name, fn):
+    """Register a callable whose value is sampled on every export, e.g. queue.qsize."""
+    with _lock:
+        _gauge_fns[name] = fn
+
+def observe(name, value, **labels):
+    if not ENABLED:
+        return
+    bounds = BUCKETS.get(name, DEFAULT_BUCKETS)
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(bounds) + 2)
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                h[i] += 1
+                break
+        else:
+            h[len(bounds)] += 1
+        h[-1] += value
+
+def _sample_fns():
+    values = {}
+    for name, fn in list(_gauge_fns.items()):
+        try:
+            values[name] = fn()
+        except Exception:
+            continue
+    return values
+
+def snapshot():
+    """All current values as a JSON-serialisable dict."""
+    fns = _sample_fns()
+    with _lock:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _counters.items()]
+        gauges = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _gauges.items()]
+        hists = []
+        for (n, l), h in _histograms.items():
+            bounds = BUCKETS.get(n, DEFAULT_BUCKETS)
+            hists.append({"name": n, "labels": dict(l), "buckets": dict(zip([str(b) for b in bounds] + ["+Inf"], h[:-1])),
+                          "count": sum(h[:-1]), "sum": h[-1]})
+    gauges.extend({"name": n, "labels": {}, "value": v} for n, v in fns.items())
+    return {"enabled": ENABLED, "time": time.time(), "counters": counters, "gauges": gauges, "histograms": hists}
+
+def _escape(value):
+    # label values may come from peers; the text format only allows these three escapes
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4)."""
+    fns = _sample_fns()
+    out = []
+    seen = set()
+    def head(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                out.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+    with _lock:
+        for (n, l), v in sorted(_counters.items()):
+            head(n, "counter")
+            out.append(f"{PREFIX}{n}{_labels(l)} {v}")
+        for (n, l), v in sorted(_gauges.items()):
+            head(n, "gauge")
+            out.append(f"{PREFIX}{n}{_labels(l)} {v}")
+        for (n, l), h in sorted(_histograms.items()):
+            head(n, "histogram")
+            bounds = BUCKETS.get(n, DEFAULT_BUCKETS)
+            cumulative = 0
+            for bound, c in zip(list(bounds) + ["+Inf"], h[:-1]):
+                cumulative += c
+                out.append(f"{PREFIX}{n}_bucket{_labels(l, ('le', bound))} {cumulative}")
+            out.append(f"{PREFIX}{n}_sum{_labels(l)} {h[-1]}")
+            out.append(f"{PREFIX}{n}_count{_labels(l)} {cumulative}")
+    for n, v in sorted(fns.items()):
+        head(n, "gauge")
+        out.append(f"{PREFIX}{n} {v}")
+    return "\n".join(out) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, ctype = render_prometheus().encode('utf-8'), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, ctype = json.dumps(snapshot()).encode('utf-8'), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port, host="127.0.0.1"):
+    """
+    Enable recording and expose /metrics and /metrics.json on host:port.
+    Returns the HTTP server; call shutdown() on it to stop.
+    """
+    enable()
+    gauge_fn("threads", threading.active_count)
+    server = ThreadingHTTPServer((host, int(port)), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serve_from_env():
+    """Start the exporter if LANCHAT_METRICS_PORT is set. Returns the server or None."""
+    port = os.environ.get("LANCHAT_METRICS_PORT")
+    return serve(int(port)) if port else None
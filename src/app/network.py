@@ -1,73 +1,163 @@
 """
 Networking: UDP discovery thread and TCP server / client for chat + file.
 Uses threads and a shared incoming_queue to communicate events to the GUI.
+These are the building blocks of transport.Transport; the server side
+accepts every wire format described in protocol.py.
 """
-import socket, threading, time, json, os
-from .protocol import DISCOVERY_PORT, DISCOVERY_INTERVAL, make_presence, parse_presence
+import socket, ssl, select, selectors, threading, time, json, os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .protocol import (DISCOVERY_PORT, LEGACY_DISCOVERY_PORT, DISCOVERY_INTERVAL, PROTO_V2,
+                       make_presence, parse_presence, make_legacy_presence, parse_legacy_presence,
+                       decode_header, encode_file_header)
+from .storage import IncomingFile
+from . import metrics, pipeline, swarm
 
-CHUNK_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024  # large reads/writes keep per-chunk Python overhead off the hot path
+# header types counted by name in metrics; peers choose the type, so anything else is "other"
+KINDS = frozenset(("hello", "text", "file", "swarm_offer", "swarm", "swarm_done"))
+
+# Admission control for incoming connections, per TCPServerThread
+DEFAULT_LIMITS = {
+    "max_handlers": 32,           # connections being served concurrently
+    "max_pending": 64,            # accepted connections waiting for a handler
+    "max_transfers": 8,           # concurrent incoming file transfers, all peers
+    "max_transfers_per_peer": 2,  # concurrent incoming file transfers from one IP
+    "max_swarm_sessions": 16,     # swarm piece sessions being served; each holds a handler
+    "transfer_wait": 5.0,         # seconds a transfer may queue for a slot before "busy"
+    "retry_after": 2.0,           # seconds senders are told to back off
+    "header_timeout": 10.0,       # seconds a client has to send its header line
+    "io_timeout": 60.0,           # seconds of silence tolerated once a transfer started
+    "idle_timeout": 120.0,        # seconds a persistent connection may sit idle between messages
+    "idle_linger": 0.25,          # seconds a handler waits for the next header before handing the connection back
+    "max_idle": 256,              # idle persistent connections kept open; the longest idle is closed beyond that
+}
+
+def _udp_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    except Exception:
+        pass
+    try:
+        # bind to all interfaces to receive broadcasts
+        sock.bind(('', port))
+    except Exception:
+        # on some systems binding may fail if another process bound; it's ok
+        pass
+    return sock
 
 class DiscoveryThread(threading.Thread):
-    def __init__(self, profiles_ref, incoming_queue, stop_event):
+    """
+    Announces local profiles and reports peers. Listens and announces on
+    both the current port and the legacy one (legacy_port=None disables it),
+    tagging every discovered profile with the wire format it speaks.
+    on_presence(ev) is called for each event before it is queued.
+    fingerprint, if given, is announced so peers can pin our TLS certificate.
+    """
+    def __init__(self, profiles_ref, incoming_queue, stop_event, port=DISCOVERY_PORT, interval=DISCOVERY_INTERVAL,
+                 legacy_port=LEGACY_DISCOVERY_PORT, on_presence=None, fingerprint=None):
         super().__init__(daemon=True)
         self.profiles_ref = profiles_ref  # should be a callable or object exposing current profiles
         self.incoming_queue = incoming_queue
         self.stop_event = stop_event
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        except Exception:
-            pass
-        try:
-            # bind to all interfaces to receive broadcasts
-            self.sock.bind(('', DISCOVERY_PORT))
-        except Exception:
-            # on some systems binding may fail if another process bound; it's ok
-            pass
+        self.port = port
+        self.interval = interval
+        self.legacy_port = legacy_port
+        self.on_presence = on_presence
+        self.fingerprint = fingerprint
+        self.sock = _udp_socket(port)
+        self.legacy_sock = _udp_socket(legacy_port) if legacy_port else None
 
     def run(self):
         # Spawn broadcaster in its own loop
         threading.Thread(target=self._broadcaster_loop, daemon=True).start()
+        if self.legacy_sock:
+            threading.Thread(target=self._receive_loop, args=(self.legacy_sock, parse_legacy_presence),
+                             daemon=True).start()
+        self._receive_loop(self.sock, parse_presence)
+
+    def _receive_loop(self, sock, parse):
         while not self.stop_event.is_set():
             try:
-                data, addr = self.sock.recvfrom(65536)
-                parsed = parse_presence(data)
+                data, addr = sock.recvfrom(65536)
+                metrics.inc("discovery_packets_total", direction="in")
+                parsed = parse(data)
                 if parsed and parsed.get("cmd") == "presence":
                     # Structure the incoming event
                     ev = {"type": "presence", "from": addr[0], "profiles": parsed.get("profiles", [])}
+                    if self.on_presence:
+                        self.on_presence(ev)
                     # push to incoming queue
                     self.incoming_queue.put(ev)
             except Exception:
+                metrics.inc("errors_total", where="discovery_recv")
                 time.sleep(0.1)
                 continue
 
+    def _broadcast(self, sock, port, payload):
+        # broadcast on IPv4 limited broadcast
+        try:
+            sock.sendto(payload, ('<broadcast>', port))
+        except Exception:
+            # try global broadcast
+            sock.sendto(payload, ('255.255.255.255', port))
+        metrics.inc("discovery_packets_total", direction="out")
+
     def _broadcaster_loop(self):
         while not self.stop_event.is_set():
             try:
                 profiles = self.profiles_ref()
-                payload = make_presence(profiles)
-                # broadcast on IPv4 limited broadcast
-                try:
-                    self.sock.sendto(payload, ('<broadcast>', DISCOVERY_PORT))
-                except Exception:
-                    # try global broadcast
-                    self.sock.sendto(payload, ('255.255.255.255', DISCOVERY_PORT))
+                self._broadcast(self.sock, self.port, make_presence(profiles, self.fingerprint))
+                if self.legacy_sock:
+                    # legacy peers only understand one dedicated-port profile per packet
+                    for p in profiles:
+                        if not p.get("shared"):
+                            self._broadcast(self.legacy_sock, self.legacy_port, make_legacy_presence(p))
             except Exception:
-                pass
-            time.sleep(DISCOVERY_INTERVAL)
+                metrics.inc("errors_total", where="discovery_send")
+            time.sleep(self.interval)
+
+class PeerBusy(Exception):
+    """Raised by the senders when the receiving peer keeps answering "busy"."""
+    def __init__(self, retry_after):
+        super().__init__(f"peer busy, retry after {retry_after}s")
+        self.retry_after = retry_after
 
 class TCPServerThread(threading.Thread):
-    def __init__(self, profile, incoming_queue, stop_event, recv_folder):
+    def __init__(self, profile, incoming_queue, stop_event, recv_folder, limits=None, tls=None, seen=None):
         """
         profile: dict with keys: name, port
+        limits: optional dict overriding DEFAULT_LIMITS
+        tls: optional tls.TLSContext; connections opening with a TLS handshake are then accepted
+        seen: optional outbox.Outbox; text messages whose "id" it already saw are acknowledged but dropped
         """
         super().__init__(daemon=True)
         self.profile = profile
         self.incoming_queue = incoming_queue
         self.stop_event = stop_event
         self.recv_folder = recv_folder
+        self.tls = tls
+        self.seen = seen
         self.sock = None
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        # handlers run on a bounded pool; the semaphore also bounds the pool's backlog
+        self.pool = ThreadPoolExecutor(max_workers=self.limits["max_handlers"],
+                                       thread_name_prefix=f"tcp-{profile['port']}")
+        self.slots = threading.Semaphore(self.limits["max_handlers"] + self.limits["max_pending"])
+        self.transfers = threading.Semaphore(self.limits["max_transfers"])
+        self.peer_transfers = {}  # ip -> active incoming transfers
+        self.swarm_sessions = threading.Semaphore(self.limits["max_swarm_sessions"])
+        self.rejecting = threading.Semaphore(4)  # TLS handshakes done only to say "busy"
+        self.peer_lock = threading.Lock()
+        self.open_conns = {}  # handler thread id -> connection it serves
+        # idle persistent connections wait here, not in a handler: conn -> (reader, addr, since)
+        self.parked = OrderedDict()
+        self.parking = deque()  # handed back by handlers, picked up by the accept loop
+        self.ready = deque()    # parked connections with a header waiting for a free slot
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_w.setblocking(False)
 
     def run(self):
         port = int(self.profile['port'])
@@ -75,109 +165,521 @@ class TCPServerThread(threading.Thread):
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
             self.sock.bind(('0.0.0.0', port))
-            self.sock.listen(10)
+            self.sock.listen(self.limits["max_pending"])
         except Exception as e:
             self.incoming_queue.put({"type":"server_error","profile":self.profile,"error":str(e)})
             return
+        self.sock.setblocking(False)
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ)
+        sel.register(self._wake_r, selectors.EVENT_READ)
 
         while not self.stop_event.is_set():
+            self._adopt_parked(sel)
+            for key, _ in sel.select(0.05 if self.ready else 1.0):
+                if key.fileobj is self.sock:
+                    self._accept()
+                elif key.fileobj is self._wake_r:
+                    try:
+                        self._wake_r.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    sel.unregister(key.fileobj)
+                    f, addr, _ = self.parked.pop(key.fileobj)
+                    metrics.gauge_add("idle_connections", -1)
+                    self.ready.append((key.fileobj, addr, f))
+            # connections we already served go before new ones
+            while self.ready and self.slots.acquire(blocking=False):
+                self.pool.submit(self._handle_slot, *self.ready.popleft())
+            self._expire_idle(sel)
+        self.pool.shutdown(wait=False)
+        self.sock.close()
+        sel.close()
+        # persistent connections would otherwise keep handlers (and interpreter exit) waiting
+        self._adopt_parked(None)
+        with self.peer_lock:
+            conns = list(self.open_conns.values())
+        conns += list(self.parked) + [conn for conn, _, _ in self.ready]
+        for conn in conns:
             try:
-                self.sock.settimeout(1.0)
-                conn, addr = self.sock.accept()
-                threading.Thread(target=self.handle_conn, args=(conn,addr), daemon=True).start()
-            except socket.timeout:
-                continue
-            except Exception:
-                time.sleep(0.1)
+                # below any TLS layer, so it doesn't race the handler's reads
+                socket.socket.shutdown(conn, socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for conn in list(self.parked) + [conn for conn, _, _ in self.ready]:
+            conn.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _accept(self):
+        try:
+            conn, addr = self.sock.accept()
+        except OSError:
+            return
+        conn.setblocking(True)
+        if not self.slots.acquire(blocking=False):
+            self._reject(conn)
+            return
+        self.pool.submit(self._handle_slot, conn, addr)
+
+    def _park(self, conn, f, addr):
+        """Hand an idle connection back to the accept loop, which resumes it once a header is readable."""
+        if self.stop_event.is_set():
+            conn.close()
+            return
+        self.parking.append((conn, f, addr))
+        try:
+            self._wake_w.send(b"x")
+        except OSError:
+            pass  # a full wakeup pipe is awake enough
+
+    def _adopt_parked(self, sel):
+        while self.parking:
+            conn, f, addr = self.parking.popleft()
+            if sel is None:
+                self.parked[conn] = (f, addr, 0.0)
                 continue
+            sel.register(conn, selectors.EVENT_READ)
+            self.parked[conn] = (f, addr, time.time())
+            metrics.gauge_add("idle_connections", 1)
+            if len(self.parked) > self.limits["max_idle"]:
+                self._drop_parked(sel, next(iter(self.parked)))
+
+    def _expire_idle(self, sel):
+        cutoff = time.time() - self.limits["idle_timeout"]
+        while self.parked:
+            conn = next(iter(self.parked))
+            if self.parked[conn][2] > cutoff:
+                break
+            self._drop_parked(sel, conn)
+
+    def _drop_parked(self, sel, conn):
+        sel.unregister(conn)
+        del self.parked[conn]
+        metrics.gauge_add("idle_connections", -1)
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _handle_slot(self, conn, addr, f=None):
+        metrics.gauge_add("active_connections", 1)
+        self._track(conn)
+        try:
+            self.handle_conn(conn, addr, f)
+        finally:
+            with self.peer_lock:
+                self.open_conns.pop(threading.get_ident(), None)
+            metrics.gauge_add("active_connections", -1)
+            self.slots.release()
+
+    def _track(self, conn):
+        with self.peer_lock:
+            self.open_conns[threading.get_ident()] = conn
+
+    def _reject(self, conn):
+        metrics.inc("busy_rejections_total", reason="pool")
+        if self.tls is None:
+            self._send_busy(conn)
+        elif self.rejecting.acquire(blocking=False):
+            # a TLS client only understands "busy" after the handshake; do it off the accept loop
+            threading.Thread(target=self._send_busy, args=(conn, True), daemon=True).start()
+        else:
+            conn.close()
 
-    def handle_conn(self, conn, addr):
+    def _send_busy(self, conn, handshake=False):
+        try:
+            conn.settimeout(1.0)
+            if handshake:
+                conn = self.tls.accept(conn)
+            _reply(conn, {"type":"busy","retry_after":self.limits["retry_after"]})
+        except Exception:
+            pass
+        finally:
+            conn.close()
+            if handshake:
+                self.rejecting.release()
+
+    def acquire_transfer(self, ip):
+        """
+        Wait up to transfer_wait seconds for a global and a per-peer transfer
+        slot. Returns False if the transfer should be answered with "busy".
+        """
+        deadline = time.time() + self.limits["transfer_wait"]
+        if not self.transfers.acquire(timeout=self.limits["transfer_wait"]):
+            return False
+        while True:
+            with self.peer_lock:
+                if self.peer_transfers.get(ip, 0) < self.limits["max_transfers_per_peer"]:
+                    self.peer_transfers[ip] = self.peer_transfers.get(ip, 0) + 1
+                    return True
+            if time.time() >= deadline:
+                self.transfers.release()
+                return False
+            time.sleep(0.05)
+
+    def release_transfer(self, ip):
+        with self.peer_lock:
+            n = self.peer_transfers.get(ip, 1) - 1
+            if n:
+                self.peer_transfers[ip] = n
+            else:
+                self.peer_transfers.pop(ip, None)
+        self.transfers.release()
+
+    def handle_conn(self, conn, addr, f=None):
         """
         Protocol: header_json + newline, then optional raw payload bytes (for files).
         header_json like: {"type":"text","from":"Alice","content":"Hi"}
         or {"type":"file","from":"Alice","filename":"x.png","size":12345}
+        Connections are persistent: headers are read until the peer hangs up
+        or stays idle for idle_timeout. A connection idle for idle_linger is
+        handed back to the accept loop so it doesn't hold a handler, and
+        resumed here with its reader f once the next header arrives. Legacy
+        "kind" headers are normalised by protocol.decode_header first.
+        "to" names the target profile when several profiles share one port.
+        Headers with "ack": true get a reply line before any payload:
+        {"type":"accept"} / {"type":"ok"}, or {"type":"busy","retry_after":2}.
+        A {"type":"hello"} header only asks for that reply; as headers are
+        handled in order, it also confirms everything sent before it.
+        Text headers may carry an "id"; with seen set, an id delivered before
+        is not passed on again.
+        A file header with "pipeline": "zlib" or "none" offers a framed,
+        hashed (and compressed) payload; the accept reply echoes it when the
+        payload should be sent that way, see pipeline.py.
+        Headers starting with "swarm" belong to peer-assisted distribution, see swarm.py.
+        With tls set, a connection may open with a TLS handshake instead of a header.
         """
+        profile = self.profile
         try:
-            f = conn.makefile('rb')
-            header_line = f.readline()
-            if not header_line:
+            # slow or silent clients must not hold a handler forever
+            conn.settimeout(self.limits["header_timeout"])
+            if f is None:
+                # replies are small single writes the sender waits for
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if self.tls:
+                    conn = self.tls.accept(conn)
+                    self._track(conn)
+                f = conn.makefile('rb')
+            while True:
+                if not self._header_waiting(conn, f):
+                    self._park(conn, f, addr)
+                    return
+                header_line = f.readline()
+                if not header_line:
+                    break
+                try:
+                    header = decode_header(json.loads(header_line.decode('utf-8')))
+                except ValueError:
+                    # stray bytes between messages, as the legacy stack tolerated
+                    continue
+                conn.settimeout(self.limits["io_timeout"])
+                kind = header.get("type")
+                metrics.inc("messages_received_total", kind=kind if kind in KINDS else "other", peer=addr[0])
+                metrics.inc("bytes_received_total", len(header_line), peer=addr[0])
+                if not self._dispatch(conn, f, addr, header):
+                    break
+                conn.settimeout(self.limits["header_timeout"])
+            conn.close()
+        except Exception as e:
+            metrics.inc("errors_total", where="handle_conn")
+            try:
                 conn.close()
-                return
-            header = json.loads(header_line.decode('utf-8').strip())
-            if header.get("type") == "text":
+            finally:
+                self.incoming_queue.put({"type":"conn_error","error":str(e),"profile":profile})
+
+    def _header_waiting(self, conn, f):
+        """Whether the next header is buffered or arrives within idle_linger (or the peer hung up)."""
+        conn.setblocking(False)
+        try:
+            if f.peek(1):
+                return True
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            conn.settimeout(self.limits["header_timeout"])
+        return bool(select.select([conn], [], [], self.limits["idle_linger"])[0])
+
+    def _dispatch(self, conn, f, addr, header):
+        """Handle one header. Returns False when the connection should be closed."""
+        kind = header.get("type", "")
+        profile = self.route(header)
+        if profile is None:
+            if header.get("ack"):
+                _reply(conn, {"type":"error","error":f"no profile {header.get('to')!r} here"})
+            # the rest of a legacy file would be read as headers
+            return kind != "file"
+        if kind == "hello":
+            if header.get("ack"):
+                _reply(conn, {"type":"ok"})
+        elif kind == "text":
+            msg_id = header.get("id")
+            if msg_id and self.seen is not None and not self.seen.first_delivery(str(msg_id)):
+                # a queued message sent again because our acknowledgement got lost
+                metrics.inc("duplicate_messages_total", peer=addr[0])
+            else:
                 ev = {
                     "type":"message",
-                    "profile": self.profile,
+                    "profile": profile,
                     "from": header.get("from"),
                     "from_ip": addr[0],
                     "from_port": addr[1],
                     "content": header.get("content"),
+                    "id": msg_id,
                 }
                 self.incoming_queue.put(ev)
-            elif header.get("type") == "file":
-                fname = header.get("filename","received.bin")
-                size = int(header.get("size",0))
-                os.makedirs(self.recv_folder, exist_ok=True)
-                out_path = os.path.join(self.recv_folder, fname)
-                received = 0
-                with open(out_path, 'wb') as wf:
-                    while received < size:
-                        chunk = f.read(min(64*1024, size - received))
-                        if not chunk:
-                            break
-                        wf.write(chunk)
-                        received += len(chunk)
-                        # optional: can push progress events
-                ev = {
-                    "type":"file",
-                    "profile": self.profile,
-                    "from": header.get("from"),
-                    "from_ip": addr[0],
-                    "from_port": addr[1],
-                    "filename": fname,
-                    "size": size,
-                    "path": out_path
-                }
-                self.incoming_queue.put(ev)
-            conn.close()
-        except Exception as e:
+            if header.get("ack"):
+                _reply(conn, {"type":"ok"})
+        elif kind == "file":
+            if not self.acquire_transfer(addr[0]):
+                metrics.inc("busy_rejections_total", reason="transfers")
+                _reply(conn, {"type":"busy","retry_after":self.limits["retry_after"]})
+                return False
             try:
-                conn.close()
+                # only acknowledged transfers can agree on a framed payload
+                framed = bool(header.get("ack")) and header.get("pipeline") in pipeline.CODECS
+                if header.get("ack"):
+                    _reply(conn, {"type":"accept", "pipeline": header["pipeline"]} if framed else {"type":"accept"})
+                return self._receive_file(conn, f, addr, header, profile, framed)
             finally:
-                self.incoming_queue.put({"type":"conn_error","error":str(e),"profile":self.profile})
+                self.release_transfer(addr[0])
+        elif kind.startswith("swarm"):
+            # swarm sessions take over the connection
+            swarm.handle_swarm_header(header, conn, f, addr, profile, self)
+            return False
+        return True
+
+    def route(self, header):
+        """Profile a connection is for; a dedicated server only has one."""
+        return self.profile
+
+    def _receive_file(self, conn, f, addr, header, profile, framed=False):
+        """
+        Read the payload into recv_folder. It is written to a temp file and
+        only published, under a sanitised name no other file has, once all
+        of it arrived (see storage.py). framed payloads are decoded and
+        checked by pipeline.receive_file. Returns True if it arrived complete.
+        """
+        size = int(header.get("size",0))
+        received = 0
+        started = time.perf_counter()
+        with IncomingFile(self.recv_folder, header.get("filename")) as incoming:
+            wf = incoming.file
+            if framed:
+                try:
+                    received, wire = pipeline.receive_file(f, wf, size)
+                except pipeline.IntegrityError as e:
+                    metrics.inc("errors_total", where="integrity")
+                    self.incoming_queue.put({"type":"conn_error", "profile": profile,
+                                             "error": f"{incoming.name}: {e}"})
+                    return False
+            else:
+                buf = memoryview(bytearray(CHUNK_SIZE))
+                while received < size:
+                    n = f.readinto(buf[:min(CHUNK_SIZE, size - received)])
+                    if not n:
+                        break
+                    wf.write(buf[:n])
+                    received += n
+                    # optional: can push progress events
+                wire = received
+            metrics.inc("bytes_received_total", wire, peer=addr[0])
+            if received < size:
+                self.incoming_queue.put({"type":"conn_error", "profile": profile,
+                                         "error": f"{incoming.name}: transfer cut off at {received} of {size} bytes"})
+                return False
+            out_path = incoming.commit()
+        elapsed = time.perf_counter() - started
+        if received and elapsed > 0:
+            metrics.observe("transfer_throughput_bytes_per_second", received / elapsed, direction="in")
+        ev = {
+            "type":"file",
+            "profile": profile,
+            "from": header.get("from") or addr[0],
+            "from_ip": addr[0],
+            "from_port": addr[1],
+            "filename": os.path.basename(out_path),
+            "size": size,
+            "path": out_path
+        }
+        self.incoming_queue.put(ev)
+        return True
+
+class SharedListener(TCPServerThread):
+    """
+    A single listening port shared by several local profiles. Connections are
+    routed to a profile by the "to" field of their header, so adding a profile
+    costs a dict entry instead of a port, a socket and an accept thread.
+    """
+    def __init__(self, port, incoming_queue, stop_event, recv_folder, limits=None, tls=None, seen=None):
+        super().__init__({"name": "shared", "port": port}, incoming_queue, stop_event, recv_folder, limits, tls,
+                         seen)
+        self.routes = {}  # profile name -> profile
+        self.routes_lock = threading.Lock()
+
+    def add_profile(self, profile):
+        with self.routes_lock:
+            self.routes[profile["name"]] = profile
+
+    def remove_profile(self, profile):
+        with self.routes_lock:
+            self.routes.pop(profile["name"], None)
+
+    def route(self, header):
+        with self.routes_lock:
+            if header.get("to") in self.routes:
+                return self.routes[header["to"]]
+            # swarm sessions are looked up by swarm id, not by profile
+            if header.get("type", "").startswith("swarm") and header.get("type") != "swarm_offer":
+                return self.profile
+            # older peers don't address profiles; fall back when there is only one
+            if header.get("to") is None and len(self.routes) == 1:
+                return next(iter(self.routes.values()))
+            return None
+
+def _reply(sock, obj):
+    sock.sendall((json.dumps(obj) + "\n").encode('utf-8'))
+
+def _read_reply(sock):
+    buf = b''
+    while b'\n' not in buf:
+        data = sock.recv(256)
+        if not data:
+            raise ConnectionError("peer closed the connection without replying")
+        buf += data
+    return json.loads(buf.split(b'\n', 1)[0].decode('utf-8'))
 
-def send_text(to_ip, to_port, from_name, content):
-    header = json.dumps({"type":"text","from":from_name,"content":content}) + "\n"
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(5)
+def connect(to_ip, to_port, timeout):
+    """TCP connection with the options every outgoing connection uses."""
+    peer = f"{to_ip}:{to_port}"
+    started = time.perf_counter()
     try:
-        s.connect((to_ip, int(to_port)))
-        s.sendall(header.encode('utf-8'))
-    finally:
+        s = socket.create_connection((to_ip, int(to_port)), timeout=timeout)
+    except OSError:
+        metrics.inc("errors_total", where="connect")
+        raise
+    # writes are whole messages or large chunks already; Nagle would only delay them
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    metrics.observe("connect_seconds", time.perf_counter() - started)
+    return s
+
+def request(s, line, peer, kind):
+    """
+    Send a header that asked for an acknowledgement and wait for the reply.
+    Raises PeerBusy or ConnectionError when the peer refuses.
+    """
+    s.sendall(line)
+    metrics.inc("messages_sent_total", kind=kind, peer=peer)
+    metrics.inc("bytes_sent_total", len(line), peer=peer)
+    reply = _read_reply(s)
+    if reply.get("type") == "busy":
+        raise PeerBusy(float(reply.get("retry_after", DEFAULT_LIMITS["retry_after"])))
+    if reply.get("type") == "error":
+        raise ConnectionError(reply.get("error"))
+    return reply
+
+def _open_request(to_ip, to_port, header, timeout):
+    """
+    Connect, send header asking for an acknowledgement and wait for it.
+    Returns the connected socket, or raises PeerBusy.
+    """
+    s = connect(to_ip, to_port, timeout)
+    try:
+        request(s, (json.dumps(dict(header, ack=True)) + "\n").encode('utf-8'), f"{to_ip}:{to_port}",
+                header.get("type"))
+    except Exception:
         s.close()
+        raise
+    return s
+
+def retry_busy(fn, retries):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except PeerBusy as e:
+            if attempt == retries:
+                raise
+            time.sleep(e.retry_after)
 
-def send_file(to_ip, to_port, from_name, file_path, progress_callback=None):
+def stream_file(s, file_path, peer, progress_callback=None, codec=None):
     """
-    Sends a file by first sending a JSON header line followed by raw bytes.
-    progress_callback(bytes_sent, total_bytes) is optional.
+    Send the contents of file_path on a connected socket. Plain sockets use
+    socket.sendfile (zero-copy where the OS supports it); progress is
+    reported every CHUNK_SIZE bytes. With codec (accepted by the peer) the
+    file goes through pipeline.send_file instead. Returns the number of
+    bytes of the file sent.
     """
-    fname = os.path.basename(file_path)
     total = os.path.getsize(file_path)
-    header = json.dumps({"type":"file","from":from_name,"filename":fname,"size":total}) + "\n"
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(10)
     sent = 0
+    started = time.perf_counter()
+    if codec:
+        wire = 0
+        try:
+            sent, wire = pipeline.send_file(s, file_path, codec, progress_callback)
+        finally:
+            metrics.inc("bytes_sent_total", wire, peer=peer)
+        elapsed = time.perf_counter() - started
+        if sent and elapsed > 0:
+            metrics.observe("transfer_throughput_bytes_per_second", sent / elapsed, direction="out")
+        return sent
+    # TLS encrypts in user space, and SSLSocket.sendfile would fall back to
+    # 8 KiB sends; whole-chunk writes keep the per-record overhead amortised
+    buf = memoryview(bytearray(CHUNK_SIZE)) if isinstance(s, ssl.SSLSocket) else None
     try:
-        s.connect((to_ip, int(to_port)))
-        s.sendall(header.encode('utf-8'))
         with open(file_path, 'rb') as rf:
-            while True:
-                chunk = rf.read(CHUNK_SIZE)
-                if not chunk:
+            while sent < total:
+                if buf is not None:
+                    n = rf.readinto(buf[:min(CHUNK_SIZE, total - sent)])
+                    s.sendall(buf[:n])
+                else:
+                    n = s.sendfile(rf, sent, min(CHUNK_SIZE, total - sent))
+                if not n:
                     break
-                s.sendall(chunk)
-                sent += len(chunk)
+                sent += n
                 if progress_callback:
                     progress_callback(sent, total)
     finally:
-        s.close()
\ No newline at end of file
+        metrics.inc("bytes_sent_total", sent, peer=peer)
+    elapsed = time.perf_counter() - started
+    if sent and elapsed > 0:
+        metrics.observe("transfer_throughput_bytes_per_second", sent / elapsed, direction="out")
+    return sent
+
+def send_text(to_ip, to_port, from_name, content, retries=3, to_name=None):
+    """One-shot text message on its own connection; Transport keeps connections open instead."""
+    header = {"type":"text","from":from_name,"to":to_name,"content":content}
+    retry_busy(lambda: _open_request(to_ip, to_port, header, 5).close(), retries)
+
+def send_file(to_ip, to_port, from_name, file_path, progress_callback=None, retries=3, to_name=None,
+              compress=False, verify=False):
+    """
+    Sends a file by first sending a JSON header line followed by raw bytes.
+    progress_callback(bytes_sent, total_bytes) is optional.
+    If the peer answers "busy" the send is retried after the delay it asks for,
+    up to retries times, then PeerBusy is raised.
+    to_name selects the profile when the peer uses a shared listener.
+    compress / verify offer a zlib-compressed / SHA-256-checked payload,
+    used if the peer supports it.
+    """
+    fname = os.path.basename(file_path)
+    total = os.path.getsize(file_path)
+    peer = f"{to_ip}:{to_port}"
+    offer = "zlib" if compress else "none" if verify else None
+    codec = None
+    def open_transfer():
+        nonlocal codec
+        s = connect(to_ip, to_port, 10)
+        try:
+            reply = request(s, encode_file_header(PROTO_V2, from_name, fname, total, to_name, ack=True,
+                                                  codec=offer), peer, "file")
+        except Exception:
+            s.close()
+            raise
+        codec = offer if offer and reply.get("pipeline") == offer else None
+        return s
+    s = retry_busy(open_transfer, retries)
+    try:
+        stream_file(s, file_path, peer, progress_callback, codec)
+    finally:
+        s.close()
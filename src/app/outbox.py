@@ -0,0 +1,100 @@
+"""
+Persistent outgoing message queue, and the receiving side's record of
+message ids already delivered.
+
+Messages are stored per peer (ip, port, profile name) in an SQLite database
+in APP_HOME before any attempt to send them, with an id that stays the same
+across retries and restarts. Transport drains a peer's queue in order, in
+batches, and deletes messages only once the peer acknowledged them, so a
+message is sent at least once. Receivers remember the ids they passed on
+(first_delivery) and drop redeliveries, which makes it exactly once for
+the user.
+"""
+import os, sqlite3, threading, time, uuid
+from .utils import APP_HOME
+
+DEFAULT_PATH = os.path.join(APP_HOME, "outbox.db")
+BATCH = 1000                   # messages read, sent and acknowledged together
+SEEN_TTL = 30 * 24 * 3600      # seconds a delivered id is remembered for dedup
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    from_name TEXT,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_peer ON outbox (ip, port, name, seq);
+CREATE TABLE IF NOT EXISTS seen (
+    id TEXT PRIMARY KEY,
+    at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_at ON seen (at);
+"""
+
+def _key(peer):
+    # profile names may be None (single-profile peers); NULL never compares equal in SQL
+    ip, port, name = peer
+    return ip, int(port), name or ""
+
+class Outbox:
+    def __init__(self, path=DEFAULT_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # one connection shared by the GUI, flush and server threads, serialised by lock
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            # commits survive a crash of the app; only a power cut can lose the last ones
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_SCHEMA)
+            self.db.execute("DELETE FROM seen WHERE at < ?", (time.time() - SEEN_TTL,))
+
+    def add(self, peer, from_name, content):
+        """Queue content for peer; returns the message id."""
+        msg_id = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute("INSERT INTO outbox (id, ip, port, name, from_name, content, created) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)", (msg_id, *_key(peer), from_name, content, time.time()))
+        return msg_id
+
+    def pending(self, peer, limit=BATCH):
+        """The oldest queued messages for peer: [(seq, id, from_name, content)]."""
+        with self.lock:
+            return self.db.execute("SELECT seq, id, from_name, content FROM outbox "
+                                   "WHERE ip = ? AND port = ? AND name = ? ORDER BY seq LIMIT ?",
+                                   (*_key(peer), limit)).fetchall()
+
+    def ack(self, peer, upto_seq):
+        """Drop the messages for peer up to and including seq upto_seq; returns how many."""
+        with self.lock:
+            return self.db.execute("DELETE FROM outbox WHERE ip = ? AND port = ? AND name = ? AND seq <= ?",
+                                   (*_key(peer), upto_seq)).rowcount
+
+    def count(self, peer=None):
+        with self.lock:
+            if peer is None:
+                return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM outbox WHERE ip = ? AND port = ? AND name = ?",
+                                   _key(peer)).fetchone()[0]
+
+    def peers(self):
+        """Peers with messages waiting, as (ip, port, name) keys."""
+        with self.lock:
+            rows = self.db.execute("SELECT DISTINCT ip, port, name FROM outbox").fetchall()
+        return [(ip, port, name or None) for ip, port, name in rows]
+
+    def first_delivery(self, msg_id):
+        """Record msg_id as delivered; False if it already was (a redelivery)."""
+        with self.lock:
+            return self.db.execute("INSERT OR IGNORE INTO seen (id, at) VALUES (?, ?)",
+                                   (msg_id, time.time())).rowcount == 1
+
+    def close(self):
+        with self.lock:
+            self.db.close()
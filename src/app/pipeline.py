@@ -0,0 +1,279 @@
+"""
+Staged transfer pipeline for hashed and compressed transfers.
+
+Sending is read -> hash/compress -> send and receiving is read ->
+decompress/verify -> write. The middle stage runs on a pool, several chunks
+at a time, while the calling thread keeps reading and sending in order, so
+one transfer can use several cores:
+  "thread"   worker threads; zlib and hashlib release the GIL on large
+             buffers, so they run in parallel (the default)
+  "process"  a ProcessPoolExecutor; chunks live in a
+             multiprocessing.shared_memory ring, only slot numbers and
+             digests are pickled
+Each chunk travels as a frame: FRAME (stored length, raw length, codec,
+SHA-256 of the raw bytes) followed by the stored bytes. Chunks that don't
+shrink (judged by a sample first) are sent as they are. The receiver checks every digest, so a
+corrupted chunk fails the transfer instead of landing on disk.
+Rings are only as deep as the transfer needs, and once all of them
+together reach RING_BUDGET further transfers get shallower ones.
+"""
+import atexit, hashlib, multiprocessing, os, struct, threading, zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+SLOT = 1024 * 1024                 # bytes per chunk
+FRAME = struct.Struct("!IIB32s")   # stored length, raw length, codec, sha256(raw)
+RAW, ZLIB = 0, 1
+CODECS = {"none": RAW, "zlib": ZLIB}
+LEVEL = 1                          # zlib level; favours speed, LAN links are fast
+SAMPLE = 64 * 1024                 # chunks whose first SAMPLE bytes don't shrink are sent as they are
+BACKEND = "thread"
+WORKERS = max(1, min(os.cpu_count() or 1, 8))
+RING_BUDGET = 64 * 1024 * 1024     # ring memory of all transfers together, idle rings included
+
+class IntegrityError(ValueError):
+    """A received chunk didn't match its digest or length."""
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def executor(backend=None, workers=None):
+    """Shared pool per (backend, workers), created on first use."""
+    key = (backend or BACKEND, workers or WORKERS)
+    with _pools_lock:
+        if key not in _pools and key[0] == "process":
+            # forked workers would inherit every open socket (closes would
+            # never reach peers) and fork a threaded process; start clean ones
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pools[key] = ProcessPoolExecutor(max_workers=key[1], mp_context=ctx)
+        elif key not in _pools:
+            _pools[key] = ThreadPoolExecutor(max_workers=key[1], thread_name_prefix="pipeline")
+        return _pools[key]
+
+class Ring:
+    """
+    depth slots, each an input and an output region of SLOT bytes. Process
+    pools get it in shared memory and refer to it by name.
+    """
+    def __init__(self, depth, backend):
+        self.depth = depth
+        self.nbytes = size = depth * 2 * SLOT
+        if backend == "process":
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.buf = self.shm.buf
+            self.ref = self.shm.name
+        else:
+            self.shm = None
+            self.buf = memoryview(bytearray(size))
+            self.ref = self.buf
+
+    def input(self, slot, n):
+        return self.buf[slot * 2 * SLOT:slot * 2 * SLOT + n]
+
+    def output(self, slot, n):
+        return self.buf[(slot * 2 + 1) * SLOT:(slot * 2 + 1) * SLOT + n]
+
+    def close(self):
+        if self.shm is not None:
+            self.buf = None
+            self.shm.close()
+            self.shm.unlink()
+
+_idle_rings = {}  # backend -> rings free for the next transfer
+_ring_bytes = 0  # held by all rings, in use or idle
+
+def _take_ring(backend, workers, size):
+    """
+    A ring deep enough to keep workers busy on size bytes. Past RING_BUDGET
+    rings get shallower, down to one slot. Waiting for memory instead could
+    deadlock two peers sending to each other.
+    """
+    global _ring_bytes
+    want = max(1, min(2 * workers + 1, -(-size // SLOT)))
+    with _pools_lock:
+        # reusing rings spares an allocation per transfer, and process
+        # workers stay attached to the same few segments
+        free = _idle_rings.setdefault(backend, [])
+        deep = [ring for ring in free if ring.depth >= want]
+        if deep:
+            ring = min(deep, key=lambda ring: ring.depth)
+            free.remove(ring)
+            return ring
+        # idle rings too shallow for us only hold the budget back
+        idle = [(b, ring) for b, rings in _idle_rings.items() for ring in rings]
+        while idle and _ring_bytes + want * 2 * SLOT > RING_BUDGET:
+            b, ring = idle.pop()
+            _idle_rings[b].remove(ring)
+            _ring_bytes -= ring.nbytes
+            ring.close()
+        depth = max(1, min(want, (RING_BUDGET - _ring_bytes) // (2 * SLOT)))
+        _ring_bytes += depth * 2 * SLOT
+    try:
+        return Ring(depth, backend)
+    except Exception:
+        with _pools_lock:
+            _ring_bytes -= depth * 2 * SLOT
+        raise
+
+def _give_ring(backend, ring):
+    global _ring_bytes
+    with _pools_lock:
+        free = _idle_rings.setdefault(backend, [])
+        if len(free) < 2 and _ring_bytes <= RING_BUDGET:
+            free.append(ring)
+            return
+        _ring_bytes -= ring.nbytes
+    ring.close()
+
+@atexit.register
+def _close_idle_rings():
+    with _pools_lock:
+        rings = [ring for free in _idle_rings.values() for ring in free]
+        _idle_rings.clear()
+    for ring in rings:
+        ring.close()
+
+_attached = OrderedDict()  # in process workers: shared memory name -> SharedMemory
+
+def _memory(ref):
+    # pool workers share the parent's resource tracker, which unlinks the
+    # segment if the parent dies without closing it
+    if not isinstance(ref, str):
+        return ref
+    shm = _attached.get(ref)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=ref)
+        _attached[ref] = shm
+        while len(_attached) > 4:
+            _attached.popitem(last=False)[1].close()
+    else:
+        _attached.move_to_end(ref)
+    return shm.buf
+
+def _encode(ref, slot, n, codec, level):
+    mem = _memory(ref)
+    raw = mem[slot * 2 * SLOT:slot * 2 * SLOT + n]
+    digest = hashlib.sha256(raw).digest()
+    # media and archives are already compressed; a sample is enough to tell
+    if codec == ZLIB and (n <= SAMPLE or len(zlib.compress(raw[:SAMPLE], level)) < SAMPLE * 0.9):
+        packed = zlib.compress(raw, level)
+        if len(packed) < n:
+            out = (slot * 2 + 1) * SLOT
+            mem[out:out + len(packed)] = packed
+            return len(packed), ZLIB, digest
+    return n, RAW, digest
+
+def _decode(ref, slot, stored, raw_len, codec, digest):
+    mem = _memory(ref)
+    data = mem[slot * 2 * SLOT:slot * 2 * SLOT + stored]
+    if codec == ZLIB:
+        out = (slot * 2 + 1) * SLOT
+        # never inflate past the announced length: a small frame can claim to hold gigabytes
+        d = zlib.decompressobj()
+        try:
+            unpacked = d.decompress(data, raw_len)
+        except zlib.error:
+            return False
+        if len(unpacked) != raw_len or d.unconsumed_tail or not d.eof:
+            return False
+        mem[out:out + raw_len] = unpacked
+        data = mem[out:out + raw_len]
+    return len(data) == raw_len and hashlib.sha256(data).digest() == digest
+
+def send_file(sock, file_path, codec="zlib", progress_callback=None, backend=None, workers=None):
+    """
+    Send file_path as frames. Returns (raw bytes sent, bytes on the wire).
+    """
+    backend, workers = backend or BACKEND, workers or WORKERS
+    pool = executor(backend, workers)
+    total = os.path.getsize(file_path)
+    ring = _take_ring(backend, workers, total)
+    read = sent = wire = seq = 0
+    pending = deque()  # (slot, raw length, future), in file order
+    try:
+        with open(file_path, "rb", buffering=0) as rf:
+            while read < total or pending:
+                while read < total and len(pending) < ring.depth:
+                    slot = seq % ring.depth
+                    n = rf.readinto(ring.input(slot, min(SLOT, total - read)))
+                    if not n:
+                        raise ConnectionError(f"{file_path} shrank while sending")
+                    pending.append((slot, n, pool.submit(_encode, ring.ref, slot, n, CODECS[codec], LEVEL)))
+                    read += n
+                    seq += 1
+                slot, n, fut = pending.popleft()
+                stored, used, digest = fut.result()
+                region = ring.input if used == RAW else ring.output
+                sock.sendall(FRAME.pack(stored, n, used, digest))
+                sock.sendall(region(slot, stored))
+                sent += n
+                wire += FRAME.size + stored
+                if progress_callback:
+                    progress_callback(sent, total)
+    finally:
+        for _, _, fut in pending:
+            fut.cancel()
+        for _, _, fut in pending:
+            if not fut.cancelled():
+                fut.exception()  # the slot stays in use until the worker is done with it
+        _give_ring(backend, ring)
+    return sent, wire
+
+def receive_file(f, wf, size, backend=None, workers=None):
+    """
+    Read frames worth size raw bytes from the buffered reader f into the
+    file wf. Returns (raw bytes written, bytes read off the wire); a
+    truncated stream returns early, a corrupted one raises IntegrityError.
+    """
+    backend, workers = backend or BACKEND, workers or WORKERS
+    pool = executor(backend, workers)
+    ring = _take_ring(backend, workers, size)
+    announced = written = wire = seq = 0
+    ended = False
+    pending = deque()  # (slot, raw length, codec, future), in file order
+    try:
+        while True:
+            while not ended and announced < size and len(pending) < ring.depth:
+                head = f.read(FRAME.size)
+                if len(head) < FRAME.size:
+                    ended = True
+                    break
+                stored, raw_len, codec, digest = FRAME.unpack(head)
+                if stored > SLOT or raw_len > SLOT or codec not in (RAW, ZLIB):
+                    raise IntegrityError(f"bad frame header at offset {announced}")
+                if announced + raw_len > size:
+                    raise IntegrityError(f"frame at offset {announced} runs past the announced {size} bytes")
+                slot = seq % ring.depth
+                target = ring.input(slot, stored)
+                got = 0
+                while got < stored:
+                    n = f.readinto(target[got:])
+                    if not n:
+                        break
+                    got += n
+                del target
+                wire += FRAME.size + got
+                if got < stored:
+                    ended = True
+                    break
+                pending.append((slot, raw_len, codec,
+                                pool.submit(_decode, ring.ref, slot, stored, raw_len, codec, digest)))
+                announced += raw_len
+                seq += 1
+            if not pending:
+                break
+            slot, raw_len, codec, fut = pending.popleft()
+            if not fut.result():
+                raise IntegrityError(f"chunk at offset {written} failed verification")
+            wf.write((ring.input if codec == RAW else ring.output)(slot, raw_len))
+            written += raw_len
+    finally:
+        for _, _, _, fut in pending:
+            fut.cancel()
+        for _, _, _, fut in pending:
+            if not fut.cancelled():
+                fut.exception()
+        _give_ring(backend, ring)
+    return written, wire
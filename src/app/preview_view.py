@@ -0,0 +1,117 @@
+"""
+Inline previews of received files in a chat QTextEdit.
+
+Each previewed file becomes an image in the document, named preview:N and
+shown as a placeholder until its thumbnail arrives from PreviewService.
+Only items near the viewport are requested; requests for items scrolled
+away are cancelled, and at most max_loaded thumbnails are kept decoded,
+the ones least recently in view falling back to the placeholder. Chats with
+hundreds of received images therefore cost a bounded amount of memory.
+"""
+import html
+from collections import OrderedDict
+from PySide6.QtCore import QObject, QPoint, QTimer, QUrl, Signal
+from PySide6.QtGui import QColor, QFont, QImage, QPainter, QTextDocument
+from .previews import THUMB_SIZE, PreviewService, preview_kind
+
+MAX_LOADED = 48
+MARGIN = 600  # pixels above and below the viewport that count as visible
+
+class _Bridge(QObject):
+    # carries results from worker threads to the GUI thread
+    done = Signal(int, str, object)
+
+class InlinePreviews:
+    def __init__(self, text_edit, service=None, max_loaded=MAX_LOADED):
+        self.view = text_edit
+        self.service = service or PreviewService()
+        self.max_loaded = max_loaded
+        self.items = {}              # n -> {"path", "pos", "failed", "request"}
+        self.loaded = OrderedDict()  # n -> True, least recently visible first
+        self.next_id = 0
+        self.placeholder = QImage(THUMB_SIZE, THUMB_SIZE // 2, QImage.Format_RGB32)
+        self.placeholder.fill(QColor("#d0d0d0"))
+        self.bridge = _Bridge()
+        self.bridge.done.connect(self._on_done)
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.update_visible)
+        self.view.verticalScrollBar().valueChanged.connect(lambda _: self.timer.start())
+        self.view.document().documentLayout().documentSizeChanged.connect(lambda _: self.timer.start())
+
+    def add(self, path):
+        """Append a preview of path to the view, if the file type has one."""
+        if not preview_kind(path):
+            return
+        n = self.next_id
+        self.next_id += 1
+        name = f"preview:{n}"
+        doc = self.view.document()
+        doc.addResource(QTextDocument.ImageResource, QUrl(name), self.placeholder)
+        self.view.append(f'<img src="{name}" title="{html.escape(path)}">')
+        # position of the image character, for visibility checks and relayout
+        pos = doc.lastBlock().position()
+        self.items[n] = {"path": path, "pos": pos, "failed": False, "request": None}
+        self.timer.start()
+
+    def update_visible(self):
+        vp = self.view.viewport()
+        top = self.view.cursorForPosition(QPoint(0, -MARGIN)).position()
+        bottom = self.view.cursorForPosition(QPoint(vp.width(), vp.height() + MARGIN)).position()
+        for n, item in self.items.items():
+            visible = top <= item["pos"] <= bottom
+            if visible and n in self.loaded:
+                self.loaded.move_to_end(n)
+            elif visible and item["request"] is None and not item["failed"]:
+                item["request"] = self.service.request(
+                    item["path"], lambda path, kind, data, n=n: self.bridge.done.emit(n, kind or "", data))
+            elif not visible and item["request"] is not None:
+                item["request"].cancel()
+                item["request"] = None
+        while len(self.loaded) > self.max_loaded:
+            self._unload(next(iter(self.loaded)))
+
+    def _on_done(self, n, kind, data):
+        item = self.items.get(n)
+        if item is None or item["request"] is None:
+            return  # cancelled after it finished
+        item["request"] = None
+        if not data:
+            item["failed"] = True
+            return
+        image = QImage.fromData(data) if kind != "text" else self._render_text(data.decode("utf-8", "replace"))
+        self._set_image(n, image)
+        self.loaded[n] = True
+        while len(self.loaded) > self.max_loaded:
+            self._unload(next(iter(self.loaded)))
+
+    def _unload(self, n):
+        self.loaded.pop(n, None)
+        self._set_image(n, self.placeholder)
+
+    def _set_image(self, n, image):
+        doc = self.view.document()
+        doc.addResource(QTextDocument.ImageResource, QUrl(f"preview:{n}"), image)
+        pos = self.items[n]["pos"]
+        doc.markContentsDirty(pos, 1)
+
+    def _render_text(self, text):
+        lines = text.splitlines() or [""]
+        font = QFont("monospace", 8)
+        image = QImage(THUMB_SIZE * 2, 14 * len(lines) + 8, QImage.Format_RGB32)
+        image.fill(QColor("#f4f4f4"))
+        painter = QPainter(image)
+        painter.setFont(font)
+        painter.setPen(QColor("#303030"))
+        for i, line in enumerate(lines):
+            painter.drawText(6, 16 + 14 * i, line)
+        painter.end()
+        return image
+
+    def shutdown(self):
+        self.timer.stop()
+        for item in self.items.values():
+            if item["request"] is not None:
+                item["request"].cancel()
+        self.service.shutdown()
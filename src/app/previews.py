@@ -0,0 +1,232 @@
+"""
+Thumbnails and previews of received files, made off the GUI thread.
+
+PreviewService generates previews on a small worker pool and keeps them in
+a disk cache keyed by content hash and mtime, so a file is decoded once and
+later views are a file read. Requests can be cancelled, e.g. when an item
+scrolls out of view; queued work is dropped and running work is abandoned
+at the next stage boundary.
+
+Images and PDFs are decoded with Qt (QImageReader decodes straight to the
+thumbnail size, QtPdf renders the first page); text previews are the first
+lines of the file. preview_view.py shows the results inline in a chat view.
+"""
+import hashlib, os, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .utils import APP_HOME
+
+CACHE_DIR = os.path.join(APP_HOME, "thumbnails")
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+THUMB_SIZE = 192          # longest side of image and PDF thumbnails, in pixels
+TEXT_PREVIEW_BYTES = 2048
+TEXT_PREVIEW_LINES = 8
+WORKERS = 2
+HASH_CHUNK = 1024 * 1024
+
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"}
+TEXT_EXTS = {".txt", ".md", ".log", ".csv", ".json", ".py", ".c", ".h", ".js", ".html", ".xml", ".ini", ".yaml",
+             ".yml"}
+
+def preview_kind(path):
+    """"image", "pdf", "text" or None when there is no preview for path."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in IMAGE_EXTS:
+        return "image"
+    if ext == ".pdf":
+        return "pdf"
+    if ext in TEXT_EXTS:
+        return "text"
+    return None
+
+class Cancelled(Exception):
+    pass
+
+class PreviewCache:
+    """
+    Previews on disk, one file per key, evicted least recently used first
+    once they take more than max_bytes. Hits refresh the file's mtime, so
+    the order survives restarts.
+    """
+    def __init__(self, folder=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # file name -> size, least recently used first
+        self.total = 0
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        found = []
+        for name in os.listdir(folder):
+            if name.endswith(".tmp"):
+                continue
+            st = os.stat(os.path.join(folder, name))
+            found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+        return data
+
+    def put(self, name, data):
+        path = os.path.join(self.folder, name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            evict = []
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.total -= size
+                evict.append(old)
+        for old in evict:
+            try:
+                os.remove(os.path.join(self.folder, old))
+            except OSError:
+                pass
+
+class PreviewRequest:
+    """Handle returned by PreviewService.request."""
+    def __init__(self, path):
+        self.path = path
+        self.future = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+class PreviewService:
+    """
+    request(path, on_done) generates a preview on the worker pool and calls
+    on_done(path, kind, data) from a worker thread: PNG bytes for images and
+    PDFs, UTF-8 text for text files, or None if the file can't be previewed.
+    Cancelled requests never call on_done.
+    """
+    def __init__(self, cache=None, workers=WORKERS):
+        self.cache = cache or PreviewCache()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self.keys = OrderedDict()  # (path, size, mtime_ns) -> content hash, so files are hashed once
+        self.keys_lock = threading.Lock()
+
+    def request(self, path, on_done):
+        req = PreviewRequest(path)
+        req.future = self.pool.submit(self._run, req, on_done)
+        return req
+
+    def _run(self, req, on_done):
+        try:
+            kind = preview_kind(req.path)
+            data = self._preview(req, kind) if kind else None
+            req.check()
+        except Cancelled:
+            return
+        except Exception:
+            kind, data = None, None
+        on_done(req.path, kind, data)
+
+    def _preview(self, req, kind):
+        st = os.stat(req.path)
+        name = f"{self._content_hash(req, st)}-{st.st_mtime_ns}.{'txt' if kind == 'text' else 'png'}"
+        data = self.cache.get(name)
+        if data is None:
+            req.check()
+            data = GENERATORS[kind](req.path)
+            if data is None:
+                return None
+            self.cache.put(name, data)
+        return data
+
+    def _content_hash(self, req, st):
+        key = (req.path, st.st_size, st.st_mtime_ns)
+        with self.keys_lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                return self.keys[key]
+        h = hashlib.sha1()
+        with open(req.path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                req.check()
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self.keys_lock:
+            self.keys[key] = digest
+            if len(self.keys) > 4096:
+                self.keys.popitem(last=False)
+        return digest
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def text_preview(path):
+    with open(path, "rb") as f:
+        head = f.read(TEXT_PREVIEW_BYTES)
+    if b"\0" in head:
+        return None  # binary despite the extension
+    lines = head.decode("utf-8", errors="replace").splitlines()[:TEXT_PREVIEW_LINES]
+    return "\n".join(line[:120] for line in lines).encode("utf-8")
+
+def _png_bytes(image):
+    from PySide6.QtCore import QBuffer, QByteArray, QIODevice
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    return bytes(data)
+
+def image_thumbnail(path):
+    # QImage (unlike QPixmap) may be used outside the GUI thread
+    from PySide6.QtCore import Qt
+    from PySide6.QtGui import QImageReader
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and max(size.width(), size.height()) > THUMB_SIZE:
+        # lets JPEG and friends decode at reduced size instead of full resolution
+        reader.setScaledSize(size.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None
+    if max(image.width(), image.height()) > THUMB_SIZE:
+        image = image.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return _png_bytes(image)
+
+def pdf_thumbnail(path):
+    from PySide6.QtCore import Qt
+    try:
+        from PySide6.QtPdf import QPdfDocument
+    except ImportError:
+        return None  # built without QtPdf
+    doc = QPdfDocument()
+    try:
+        doc.load(path)
+        if doc.pageCount() < 1:
+            return None
+        size = doc.pagePointSize(0).toSize()
+        image = doc.render(0, size.scaled(THUMB_SIZE, THUMB_SIZE, Qt.KeepAspectRatio))
+        return None if image.isNull() else _png_bytes(image)
+    finally:
+        doc.close()
+
+GENERATORS = {"image": image_thumbnail, "pdf": pdf_thumbnail, "text": text_preview}
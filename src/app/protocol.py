@@ -1,20 +1,118 @@
 """
 Simple protocol helpers and constants.
+
+Three wire formats are understood:
+  lanchat/2  current: "type"-keyed JSON lines, persistent connections,
+             "ack" replies and "to" routing for shared listeners
+  app/1      older profile-based peers: one "type"-keyed header per
+             connection, never any reply
+  legacy     single-profile peers: "kind"-keyed JSON lines on a persistent
+             connection, discovered on LEGACY_DISCOVERY_PORT
+Incoming headers are normalised to the lanchat/2 shape by decode_header;
+outgoing ones are produced for the peer's format by encode_text and
+encode_file_header.
 """
-import json
+import json, time
 
 DISCOVERY_PORT = 45454
+LEGACY_DISCOVERY_PORT = 9999
 DISCOVERY_INTERVAL = 5  # seconds
+SHARED_PORT = 45455     # default port of the shared listener
+
+PROTO_V2 = "lanchat/2"
+PROTO_APP1 = "app/1"
+PROTO_LEGACY = "legacy"
+# when a peer is heard in several formats, talk the best one
+PROTO_RANK = {PROTO_LEGACY: 0, PROTO_APP1: 1, PROTO_V2: 2}
 
-def make_presence(profiles):
-    # profiles: list of dicts {"name":..., "port":...}
-    return json.dumps({
+def make_presence(profiles, fingerprint=None):
+    # profiles: list of dicts {"name":..., "port":..., "shared": bool}
+    # profiles behind the shared listener are sent as a plain list of names
+    # fingerprint: SHA-256 of our TLS certificate, when TLS is enabled
+    msg = {
         "cmd": "presence",
-        "profiles": profiles
-    }).encode('utf-8')
+        "v": 2,
+        "profiles": [{"name": p["name"], "port": p["port"]} for p in profiles if not p.get("shared")]
+    }
+    shared = [p for p in profiles if p.get("shared")]
+    if shared:
+        msg["shared"] = {"port": shared[0]["port"], "names": [p["name"] for p in shared]}
+    if fingerprint:
+        msg["fp"] = fingerprint
+    return json.dumps(msg, separators=(',', ':')).encode('utf-8')
 
 def parse_presence(data_bytes):
     try:
-        return json.loads(data_bytes.decode('utf-8'))
+        msg = json.loads(data_bytes.decode('utf-8'))
+    except Exception:
+        return None
+    if not isinstance(msg, dict):
+        return None
+    shared = msg.get("shared")
+    if shared:
+        msg.setdefault("profiles", []).extend(
+            {"name": n, "port": shared["port"], "shared": True} for n in shared.get("names", []))
+    proto = PROTO_V2 if msg.get("v") == 2 else PROTO_APP1
+    for p in msg.get("profiles", []):
+        p["proto"] = proto
+        if msg.get("fp"):
+            p["fp"] = msg["fp"]
+    return msg
+
+def make_legacy_presence(profile):
+    return json.dumps({'type': 'presence', 'name': profile["name"], 'port': profile["port"]}).encode('utf-8')
+
+def parse_legacy_presence(data_bytes):
+    """Legacy announcements carry one profile each; returned in parse_presence's shape."""
+    try:
+        pkg = json.loads(data_bytes.decode('utf-8'))
+        if pkg.get('type') != 'presence':
+            return None
+        profile = {"name": pkg.get('name'), "port": int(pkg.get('port')), "proto": PROTO_LEGACY}
     except Exception:
-        return None
\ No newline at end of file
+        return None
+    return {"cmd": "presence", "profiles": [profile]}
+
+def make_message_json(kind, payload):
+    return json.dumps({'kind': kind, 'time': time.time(), 'payload': payload}, separators=(',',':')).encode('utf-8') + b'\n'
+
+def _line(header):
+    return (json.dumps(header, separators=(',', ':')) + "\n").encode('utf-8')
+
+def encode_text(proto, from_name, content, to_name=None, msg_id=None):
+    # msg_id: durable id of a queued message, so receivers can drop redeliveries
+    if proto == PROTO_LEGACY:
+        return make_message_json('chat', {'from': from_name, 'text': content})
+    header = {"type": "text", "from": from_name, "content": content}
+    if proto == PROTO_V2:
+        header["to"] = to_name
+        if msg_id:
+            header["id"] = msg_id
+    return _line(header)
+
+def encode_hello(from_name, to_name=None):
+    # opens a lanchat/2 connection; the reply says whether the peer admits us
+    return _line({"type": "hello", "from": from_name, "to": to_name, "ack": True})
+
+def encode_file_header(proto, from_name, filename, size, to_name=None, ack=False, codec=None):
+    # codec: offer a framed payload (see pipeline.py); the receiver's accept reply says if it's used
+    if proto == PROTO_LEGACY:
+        return _line({'kind': 'file', 'filename': filename, 'size': size})
+    header = {"type": "file", "from": from_name, "filename": filename, "size": size}
+    if proto == PROTO_V2:
+        header.update({"to": to_name, "ack": ack})
+        if codec:
+            header["pipeline"] = codec
+    return _line(header)
+
+def decode_header(header):
+    """Normalise a received header of any format to the lanchat/2 shape."""
+    if "type" in header or "kind" not in header:
+        return header
+    kind = header.get('kind')
+    if kind == 'file':
+        return {"type": "file", "filename": header.get('filename'), "size": header.get('size'), "proto": PROTO_LEGACY}
+    payload = header.get('payload') or {}
+    if kind == 'chat':
+        return {"type": "text", "from": payload.get('from'), "content": payload.get('text'), "proto": PROTO_LEGACY}
+    return {"type": f"legacy-{kind}", "payload": payload, "proto": PROTO_LEGACY}
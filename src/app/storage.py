@@ -0,0 +1,110 @@
+"""
+Safe storage of received files.
+
+Peers choose file names, so a name is reduced to a plain file name before
+it touches the disk: no directories, no traversal, nothing Windows can't
+store. Data is streamed into a hidden temp file in the destination folder
+and only committed once complete, by an atomic rename to a name no other
+file has; a file with the same name is never overwritten, the new one is
+stored as "name (1).ext" and so on. Readers therefore never see a
+half-written file, and concurrent receives of one name can't interleave.
+"""
+import os, re, tempfile, threading, unicodedata
+
+DEFAULT_NAME = "received.bin"
+MAX_NAME_BYTES = 200
+# characters Windows refuses in file names, plus ASCII control characters
+_UNSAFE = re.compile(r'[<>:"/\\|?*\x00-\x1f\x7f]')
+_RESERVED = {"CON", "PRN", "AUX", "NUL", *(f"COM{i}" for i in range(1, 10)), *(f"LPT{i}" for i in range(1, 10))}
+
+_commit_lock = threading.Lock()  # name choice and rename happen together within this process
+# mkstemp makes its files owner-only; published files get the mode open() would have given them.
+# Reading the umask means setting it, so it is done once, before any threads run.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def safe_filename(name, default=DEFAULT_NAME):
+    """A plain file name derived from a name a peer sent us."""
+    name = unicodedata.normalize("NFC", str(name or ""))
+    # keep only the last component, whichever separator the sender's OS uses
+    name = re.split(r"[/\\]", name)[-1]
+    name = _UNSAFE.sub("_", name).strip(" .")
+    if not name:
+        return default
+    # Windows reserves device names whatever follows the first dot: CON.tar.gz is CON
+    if name.split(".")[0].rstrip(" ").upper() in _RESERVED:
+        name = "_" + name
+    stem, ext = os.path.splitext(name)
+    if len(ext.encode("utf-8")) > 16:
+        stem, ext = stem + ext, ""
+    while len((stem + ext).encode("utf-8")) > MAX_NAME_BYTES:
+        stem = stem[:-1]
+    return stem + ext
+
+def _candidates(name):
+    stem, ext = os.path.splitext(name)
+    yield name
+    n = 1
+    while True:
+        yield f"{stem} ({n}){ext}"
+        n += 1
+
+class IncomingFile:
+    """
+    A file being received into folder. Write through .file (or write()),
+    then commit() to publish it under a free name, or discard() to drop it.
+    Usable as a context manager: leaving the block without commit() discards.
+    """
+    def __init__(self, folder, filename):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.name = safe_filename(filename)
+        fd, self.tmp_path = tempfile.mkstemp(dir=folder, prefix=f".{self.name[:64]}.", suffix=".part")
+        self.file = os.fdopen(fd, "w+b")
+        self.path = None  # final path, once committed
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def commit(self):
+        """Publish the file atomically under a name not taken yet; returns its path."""
+        # the data must be on disk before the name is, or a crash can publish a truncated file
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        try:
+            os.chmod(self.tmp_path, 0o666 & ~_UMASK)
+        except OSError:
+            pass  # filesystems without permissions keep their own
+        with _commit_lock:
+            for name in _candidates(self.name):
+                path = os.path.join(self.folder, name)
+                if os.path.lexists(path):
+                    continue
+                try:
+                    # a hard link fails instead of replacing a file another process just created
+                    os.link(self.tmp_path, path)
+                    os.unlink(self.tmp_path)
+                except FileExistsError:
+                    continue
+                except OSError:
+                    # filesystems without hard links
+                    os.replace(self.tmp_path, path)
+                self.path = path
+                return path
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if self.path is None:
+            try:
+                os.unlink(self.tmp_path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.discard()
+        return False
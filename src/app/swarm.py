@@ -0,0 +1,597 @@
+"""
+Peer-assisted one-to-many file distribution ("swarm" mode).
+
+The sender seeds the file in fixed-size pieces and offers it to every receiver.
+Receivers fetch pieces from each other as well as from the seed, exchanging
+availability bitmaps over the TCP control channel, so the seed uploads roughly
+one copy of the file no matter how many receivers there are.
+
+Control channel (JSON lines, same framing as the rest of the protocol):
+  {"type":"swarm_offer", ...}      seed -> receiver, starts a download; asks for
+                                   {"type":"ok"}, no reply means the peer can't take part;
+                                   {"type":"busy"} or {"type":"error"} means it won't
+  {"type":"swarm","swarm_id":..}   opens a piece session ("to" names the receiving
+                                   profile; without it, the seed), followed by requests,
+                                   or answered {"type":"busy"} when the peer serves enough:
+      {"op":"have"}                -> {"have": b64 bitmap, "served": b64 bitmap}
+      {"op":"get","piece":i}       -> {"piece":i,"size":n} + n raw bytes
+                                      or {"piece":i,"error":"missing"}
+      {"op":"get","piece":i,"fresh":true}
+                                   -> as above, or {"piece":i,"error":"served",...}
+                                      if the piece was already handed out once
+  {"type":"swarm_done", ...}       receiver -> seed once the file is complete, or
+                                   with "error" once it gave up
+"""
+import base64, hashlib, json, math, os, random, threading, time, uuid
+from . import metrics, network
+from .storage import IncomingFile, safe_filename
+
+PIECE_SIZE = 1024 * 1024
+MAX_PIECE_SIZE = 16 * 1024 * 1024  # pieces are read into memory whole; offers with larger ones are refused
+MAX_SOURCES = 4        # receivers a downloader pulls from, besides the seed
+HAVE_REFRESH = 0.5     # seconds between availability refreshes per source
+SEED_PATIENCE = 2.0    # wait this long before asking the seed for a piece it already served
+LINGER = 30.0          # keep serving pieces this long after the last request
+STALL_TIMEOUT = 60.0   # a seed gives up once no receiver asked or reported anything for this long
+
+# (swarm_id, profile name) -> Swarm; seeds use None. Profiles hosted by one
+# process each download their own copy, so they can't share an entry.
+_swarms = {}
+_swarms_lock = threading.Lock()
+_slots = {}  # (server, swarm_id) -> downloads sharing the server's transfer slot for it
+
+def register(swarm):
+    with _swarms_lock:
+        _swarms[swarm.key] = swarm
+
+def unregister(key):
+    with _swarms_lock:
+        return _swarms.pop(key, None)
+
+def lookup(swarm_id, name=None):
+    """The download of profile name in swarm_id, falling back to the seed."""
+    with _swarms_lock:
+        return _swarms.get((swarm_id, name)) or _swarms.get((swarm_id, None))
+
+def _peer_key(peer):
+    # (ip, port) from older senders, (ip, port, profile name) otherwise
+    ip, port, *rest = peer
+    return ip, int(port), (rest[0] if rest else None)
+
+def _pack(bits):
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+def _unpack(text):
+    return bytearray(base64.b64decode(text)) if text else bytearray()
+
+def _bit(bits, i):
+    return i >> 3 < len(bits) and bits[i >> 3] & (0x80 >> (i & 7))
+
+def _set_bit(bits, i):
+    bits[i >> 3] |= 0x80 >> (i & 7)
+
+class SourceBusy(Exception):
+    """A source answered a piece session with "busy"."""
+    def __init__(self, retry_after):
+        super().__init__(f"source busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def _send_line(sock, obj):
+    sock.sendall((json.dumps(obj) + "\n").encode('utf-8'))
+
+def _read_line(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    return json.loads(line.decode('utf-8'))
+
+class Swarm:
+    """
+    State shared by the seed and the receivers: piece layout, what we have
+    and the file we serve pieces from.
+    """
+    def __init__(self, swarm_id, filename, size, piece_size, hashes, path):
+        self.swarm_id = swarm_id
+        self.key = (swarm_id, None)
+        self.filename = filename
+        self.size = size
+        self.piece_size = piece_size
+        self.hashes = hashes
+        self.path = path
+        self.count = len(hashes)
+        self.have = bytearray((self.count + 7) // 8)
+        self.served = bytearray(len(self.have))
+        self.uploaded = 0
+        self.last_request = time.time()
+        self.lock = threading.Lock()
+        self._fh = None
+        self.tls = None  # tls.TLSContext; peers with a pinned certificate are talked to over TLS
+
+    def _connect(self, peer, timeout):
+        """Connection to (ip, port, ...), wrapped in TLS if its certificate is pinned."""
+        ip, port = peer[0], peer[1]
+        s = network.connect(ip, port, timeout)
+        if self.tls and self.tls.pinned(ip):
+            try:
+                s = self.tls.wrap(s, ip, port)
+            except Exception:
+                s.close()
+                raise
+        return s
+
+    def piece_length(self, i):
+        return min(self.piece_size, self.size - i * self.piece_size)
+
+    def has(self, i):
+        with self.lock:
+            return bool(_bit(self.have, i))
+
+    def _read_piece(self, i):
+        with self.lock:
+            self._fh.seek(i * self.piece_size)
+            return self._fh.read(self.piece_length(i))
+
+    def serve(self, conn, f):
+        """Answer piece requests on an accepted session until the peer hangs up."""
+        peer = conn.getpeername()[0]
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            req = json.loads(line.decode('utf-8'))
+            self.last_request = time.time()
+            if req.get("op") == "have":
+                with self.lock:
+                    reply = {"have": _pack(self.have), "served": _pack(self.served)}
+                _send_line(conn, reply)
+            elif req.get("op") == "get":
+                i = int(req.get("piece", -1))
+                if not (0 <= i < self.count) or not self.has(i):
+                    _send_line(conn, {"piece": i, "error": "missing"})
+                    continue
+                with self.lock:
+                    # "fresh" requests only want pieces nobody fetched from us yet
+                    if req.get("fresh") and _bit(self.served, i):
+                        reply = {"piece": i, "error": "served", "served": _pack(self.served)}
+                    else:
+                        reply = None
+                        _set_bit(self.served, i)
+                if reply:
+                    _send_line(conn, reply)
+                    continue
+                data = self._read_piece(i)
+                _send_line(conn, {"piece": i, "size": len(data)})
+                conn.sendall(data)
+                metrics.inc("bytes_sent_total", len(data), peer=peer)
+                with self.lock:
+                    self.uploaded += len(data)
+            else:
+                return
+
+    def close(self):
+        unregister(self.key)
+        with self.lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+
+class SwarmSeed(Swarm):
+    """The original sender: has every piece and tracks which receivers finished."""
+    def __init__(self, file_path, piece_size=PIECE_SIZE, tls=None):
+        size = os.path.getsize(file_path)
+        hashes = []
+        with open(file_path, 'rb') as rf:
+            while True:
+                piece = rf.read(piece_size)
+                if not piece:
+                    break
+                hashes.append(hashlib.sha1(piece).hexdigest())
+        super().__init__(uuid.uuid4().hex, os.path.basename(file_path), size, piece_size, hashes, file_path)
+        for i in range(self.count):
+            _set_bit(self.have, i)
+        self._fh = open(file_path, 'rb')
+        self.tls = tls
+        self.pending = set()
+        self.failed = {}  # receiver -> why it didn't get the file
+        self.done = threading.Event()
+
+    def offer(self, peers, from_name, seed_port):
+        """
+        Offer the file to every (ip, port) or (ip, port, profile name) in
+        peers. Each receiver is told about all the others so it can fetch
+        pieces from them. Receivers that can't be reached or don't confirm
+        the offer (older clients ignore it) are left out of the wait;
+        returns them as {peer: error}, also kept in self.failed.
+        """
+        # profiles sharing one listener share (ip, port); the name tells them apart
+        peers = list(dict.fromkeys(_peer_key(p) for p in peers))
+        self.pending = set(peers)
+        register(self)
+        for peer in peers:
+            header = {
+                "type": "swarm_offer",
+                "from": from_name,
+                "to": peer[2],
+                "swarm_id": self.swarm_id,
+                "filename": self.filename,
+                "size": self.size,
+                "piece_size": self.piece_size,
+                "hashes": self.hashes,
+                "seed_port": int(seed_port),
+                "you": list(peer),
+                "peers": [list(p) for p in peers if p != peer],
+                "ack": True,
+            }
+            try:
+                s = self._connect(peer, 10)
+                try:
+                    _send_line(s, header)
+                    line = s.makefile('rb').readline()
+                    if self.tls:
+                        self.tls.save_session(s, *peer[:2])
+                finally:
+                    s.close()
+                if not line:
+                    raise ConnectionError("no reply to the offer")
+                reply = json.loads(line.decode('utf-8'))
+                if reply.get("type") != "ok":
+                    raise ConnectionError(reply.get("error") or f"offer refused ({reply.get('type')})")
+            except (OSError, ValueError) as e:
+                self.mark_done(peer, str(e))
+        self.last_request = time.time()  # the stall clock starts once everyone was offered the file
+        if not peers:
+            self.done.set()
+        return self.failed
+
+    def mark_done(self, peer, error=None):
+        """Receiver peer is done with the file; error says why it didn't get it."""
+        with self.lock:
+            if error:
+                self.failed[peer] = error
+            self.pending.discard(peer)
+            self.last_request = time.time()
+            finished = not self.pending
+        if finished:
+            self.done.set()
+
+    def wait(self, timeout=None, stall=None):
+        """
+        Block until every receiver reported back, then stop seeding. With
+        stall, give up once no receiver asked for anything or reported for
+        that many seconds: receivers still pending are moved to failed and
+        seeding stops. Returns whether every receiver reported.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            step = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.time()))
+            if self.done.wait(step):
+                self.close()
+                return True
+            if stall is not None and time.time() - self.last_request > stall:
+                with self.lock:
+                    for peer in self.pending:
+                        self.failed[peer] = f"no progress for {stall:.0f}s"
+                    self.pending.clear()
+                self.close()
+                return False
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+class SwarmDownload(Swarm, threading.Thread):
+    """A receiver: pulls pieces from the seed and a few other receivers."""
+    def __init__(self, header, seed_ip, profile, incoming_queue, recv_folder, release=None, tls=None):
+        Swarm.__init__(self, header["swarm_id"], safe_filename(header.get("filename")),
+                       int(header["size"]), int(header["piece_size"]), header["hashes"], None)
+        threading.Thread.__init__(self, daemon=True)
+        self.from_name = header.get("from")
+        self.seed = (seed_ip, int(header["seed_port"]))
+        self.key = (self.swarm_id, profile["name"])
+        self.me = _peer_key(header["you"]) if header.get("you") else ()
+        others = [_peer_key(p) for p in header.get("peers", [])]
+        random.shuffle(others)
+        self.sources = others[:MAX_SOURCES]
+        self.profile = profile
+        self.incoming_queue = incoming_queue
+        self.release = release  # frees the receiver's transfer slot once the download ended
+        self.tls = tls
+        # pieces land in a temp file, published under a free name once all are verified
+        self.incoming = IncomingFile(recv_folder, self.filename)
+        self.path = self.incoming.tmp_path
+        self._fh = self.incoming.file
+        self._fh.truncate(self.size)
+        self.maps = {}           # source -> latest have bitmap
+        self.counts = [0] * self.count
+        self.seed_served = bytearray(len(self.have))
+        self.inflight = set()
+        self.complete = threading.Event()
+        if self.count == 0:
+            self.complete.set()
+
+    # piece selection -------------------------------------------------------
+    def _recount(self):
+        maps = list(self.maps.values())
+        self.counts = [sum(1 for bits in maps if _bit(bits, i)) for i in range(self.count)]
+
+    def _pick(self, source, since_idle):
+        """
+        Rarest-first among pieces the source has and we still need. The seed
+        is only asked for pieces none of our other sources can give us, and
+        pieces it already served once are only requested after SEED_PATIENCE,
+        since they are likely to reach one of our sources soon.
+        """
+        counts = self.counts
+        with self.lock:
+            if source == self.seed:
+                wanted = [i for i in range(self.count)
+                          if not _bit(self.have, i) and i not in self.inflight and counts[i] == 0]
+                fresh = [i for i in wanted if not _bit(self.seed_served, i)]
+                if fresh:
+                    wanted = fresh
+                elif since_idle < SEED_PATIENCE:
+                    return None
+            else:
+                bits = self.maps.get(source, b'')
+                wanted = [i for i in range(self.count)
+                          if _bit(bits, i) and not _bit(self.have, i) and i not in self.inflight]
+            if not wanted:
+                return None
+            random.shuffle(wanted)
+            i = min(wanted, key=counts.__getitem__)
+            self.inflight.add(i)
+            return i
+
+    # transfer ----------------------------------------------------------------
+    def _store(self, i, data):
+        if len(data) != self.piece_length(i) or hashlib.sha1(data).hexdigest() != self.hashes[i]:
+            return False
+        with self.lock:
+            self._fh.seek(i * self.piece_size)
+            self._fh.write(data)
+            _set_bit(self.have, i)
+            done = all(_bit(self.have, n) for n in range(self.count))
+        if done:
+            self.complete.set()
+        return True
+
+    def _refresh(self, source, sock, f):
+        _send_line(sock, {"op": "have"})
+        reply = _read_line(f)
+        if reply.get("type") == "busy":
+            raise SourceBusy(float(reply.get("retry_after") or 1.0))
+        with self.lock:
+            if source == self.seed:
+                self.seed_served = _unpack(reply.get("served"))
+            else:
+                self.maps[source] = _unpack(reply.get("have"))
+                self._recount()
+
+    def _pull(self, source):
+        # other receivers are just dropped when busy; the seed may be the only one with a piece
+        while not self.complete.is_set():
+            try:
+                return self._session(source)
+            except SourceBusy as e:
+                if source != self.seed:
+                    return
+                time.sleep(e.retry_after)
+
+    def _session(self, source):
+        try:
+            sock = self._connect(source, 30)
+        except OSError:
+            return
+        f = sock.makefile('rb')
+        idle_since = time.time()
+        last_refresh = 0
+        try:
+            session = {"type": "swarm", "swarm_id": self.swarm_id}
+            if source != self.seed and source[2] is not None:
+                session["to"] = source[2]
+            _send_line(sock, session)
+            while not self.complete.is_set():
+                if time.time() - last_refresh > HAVE_REFRESH:
+                    self._refresh(source, sock, f)
+                    last_refresh = time.time()
+                idle = time.time() - idle_since
+                i = self._pick(source, idle)
+                if i is None:
+                    time.sleep(0.05)
+                    continue
+                try:
+                    fresh = source == self.seed and idle < SEED_PATIENCE
+                    _send_line(sock, {"op": "get", "piece": i, "fresh": fresh})
+                    reply = _read_line(f)
+                    if reply.get("error") == "served":
+                        with self.lock:
+                            self.seed_served = _unpack(reply.get("served"))
+                        continue
+                    if reply.get("error"):
+                        last_refresh = 0
+                        continue
+                    size = int(reply["size"])
+                    if not 0 <= size <= self.piece_length(i):
+                        # the stream can't be trusted past a bogus length; drop the source
+                        raise ValueError(f"piece {i}: bad size {size}")
+                    data = f.read(size)
+                    metrics.inc("bytes_received_total", len(data), peer=source[0])
+                    self._store(i, data)
+                    idle_since = time.time()
+                finally:
+                    with self.lock:
+                        self.inflight.discard(i)
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                if self.maps.pop(source, None) is not None:
+                    self._recount()
+            try:
+                _send_line(sock, {"op": "bye"})
+            except OSError:
+                pass
+            sock.close()
+
+    def run(self):
+        try:
+            workers = [threading.Thread(target=self._pull, args=(src,), daemon=True)
+                       for src in [self.seed] + self.sources]
+            for w in workers:
+                w.start()
+            while not self.complete.wait(0.5):
+                if not any(w.is_alive() for w in workers):
+                    break
+        finally:
+            # lingering only answers other receivers, which their own sessions pay for
+            if self.release:
+                self.release()
+        if not self.complete.is_set():
+            self.incoming_queue.put({"type": "conn_error", "error": f"swarm {self.filename}: all sources lost",
+                                     "profile": self.profile})
+            self.close()
+            self.incoming.discard()
+            self._report("all sources lost")
+            return
+        with self.lock:
+            self.path = self.incoming.commit()
+            self._fh = open(self.path, 'rb')
+        self.incoming_queue.put({
+            "type": "file",
+            "profile": self.profile,
+            "from": self.from_name,
+            "from_ip": self.seed[0],
+            "from_port": self.seed[1],
+            "filename": os.path.basename(self.path),
+            "size": self.size,
+            "path": self.path,
+        })
+        self._report()
+        # keep re-serving pieces to the other receivers until they go quiet
+        self.last_request = time.time()
+        while time.time() - self.last_request < LINGER:
+            time.sleep(1.0)
+        self.close()
+
+    def _report(self, error=None):
+        """Tell the seed we are done with the file, or why we gave up on it."""
+        done = {"type": "swarm_done", "swarm_id": self.swarm_id, "peer": list(self.me)}
+        if error:
+            done["error"] = error
+        try:
+            s = self._connect(self.seed, 10)
+            try:
+                _send_line(s, done)
+            finally:
+                s.close()
+        except OSError:
+            pass
+
+def _hold(server, swarm_id, ip):
+    """Take server's transfer slot for swarm_id; the profiles it hosts share one per swarm."""
+    with _swarms_lock:
+        if _slots.get((server, swarm_id)):
+            _slots[server, swarm_id] += 1
+            return True
+    if not server.acquire_transfer(ip):
+        return False
+    with _swarms_lock:
+        _slots[server, swarm_id] = _slots.get((server, swarm_id), 0) + 1
+        extra = _slots[server, swarm_id] > 1
+    if extra:
+        server.release_transfer(ip)  # another profile took one meanwhile
+    return True
+
+def _unhold(server, swarm_id, ip):
+    with _swarms_lock:
+        _slots[server, swarm_id] -= 1
+        last = not _slots[server, swarm_id]
+        if last:
+            del _slots[server, swarm_id]
+    if last:
+        server.release_transfer(ip)
+
+def _check_offer(header):
+    """Why an offer can't be downloaded, or None."""
+    try:
+        size, piece_size = int(header["size"]), int(header["piece_size"])
+        hashes = header["hashes"]
+        header["swarm_id"], header["seed_port"]
+    except (KeyError, TypeError, ValueError):
+        return "malformed offer"
+    if size < 0 or not 0 < piece_size <= MAX_PIECE_SIZE:
+        return "bad piece size"
+    if not isinstance(hashes, list) or len(hashes) != math.ceil(size / piece_size):
+        return "piece hashes don't cover the file"
+    return None
+
+def handle_swarm_header(header, conn, f, addr, profile, server):
+    """
+    Dispatch a swarm control header received by server, a TCPServerThread.
+    A download holds one of its transfer slots until it ended, and piece
+    sessions are bounded by its max_swarm_sessions; either answers "busy"
+    when none is free.
+    """
+    kind = header.get("type")
+    busy = {"type": "busy", "retry_after": server.limits["retry_after"]}
+    if kind == "swarm_offer":
+        error = _check_offer(header)
+        if error:
+            metrics.inc("errors_total", where="swarm_offer")
+            if header.get("ack"):
+                _send_line(conn, {"type": "error", "error": error})
+            return
+        # every profile offered the file downloads it; the offer may still arrive twice
+        key = (header["swarm_id"], profile["name"])
+        with _swarms_lock:
+            known = key in _swarms
+        if not known:
+            if not _hold(server, key[0], addr[0]):
+                metrics.inc("busy_rejections_total", reason="transfers")
+                if header.get("ack"):
+                    _send_line(conn, busy)
+                return
+            release = lambda: _unhold(server, key[0], addr[0])
+            with _swarms_lock:
+                download = None
+                try:
+                    if key not in _swarms:
+                        download = SwarmDownload(header, addr[0], profile, server.incoming_queue,
+                                                 server.recv_folder, release, server.tls)
+                        _swarms[key] = download
+                finally:
+                    if download is None:
+                        release()
+            if download is not None:
+                download.start()
+        if header.get("ack"):
+            _send_line(conn, {"type": "ok"})
+        return
+    if kind == "swarm":
+        swarm = lookup(header.get("swarm_id"), header.get("to") or profile["name"])
+        if swarm is None:
+            return
+        if not server.swarm_sessions.acquire(blocking=False):
+            # the puller drops us as a source and keeps its others
+            metrics.inc("busy_rejections_total", reason="swarm_sessions")
+            _send_line(conn, busy)
+            return
+        try:
+            swarm.serve(conn, f)
+        finally:
+            server.swarm_sessions.release()
+    elif kind == "swarm_done":
+        swarm = lookup(header.get("swarm_id"))
+        if isinstance(swarm, SwarmSeed):
+            swarm.mark_done(_peer_key(header.get("peer") or [addr[0], 0]), header.get("error"))
+
+def send_swarm(peers, from_name, file_path, seed_port, piece_size=PIECE_SIZE, tls=None):
+    """
+    Distribute file_path to every (ip, port[, name]) in peers with peer-assisted
+    fan-out. seed_port must be the port of a running TCPServerThread, which
+    serves pieces for the seed. Returns the SwarmSeed; call wait() on it to
+    block until all receivers finished. Receivers the offer couldn't reach
+    are listed in its failed dict. With tls, offers to peers whose
+    certificate is pinned go over TLS, as the receivers' own traffic does.
+    """
+    seed = SwarmSeed(file_path, piece_size, tls)
+    seed.offer(peers, from_name, seed_port)
+    return seed
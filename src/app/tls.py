@@ -0,0 +1,131 @@
+"""
+Optional TLS for peer connections.
+
+Every installation has one self-signed certificate, made with the openssl
+command line tool the first time TLS is enabled. Its SHA-256 fingerprint is
+announced in discovery and peers trust it on first use: the first
+fingerprint seen for an IP is pinned in known_peers.json, and a peer whose
+certificate no longer matches is refused. Delete the pin to accept a new key.
+
+Servers tell TLS from plaintext by the first byte of a connection, so
+encrypted and plaintext peers keep talking to each other. Clients cache the
+TLS session per peer so reconnects resume instead of doing a full handshake.
+"""
+import hashlib, json, os, socket, ssl, subprocess, threading
+from .utils import APP_HOME as HOME
+from . import metrics
+
+HANDSHAKE = b"\x16"  # first byte of a TLS ClientHello; headers start with "{"
+
+class FingerprintMismatch(ConnectionError):
+    """The peer's certificate doesn't match the fingerprint pinned for it."""
+    def __init__(self, ip, pinned, seen):
+        super().__init__(f"certificate of {ip} changed: pinned {pinned[:16]}..., got {seen[:16]}...")
+        self.ip = ip
+        self.pinned = pinned
+        self.seen = seen
+
+def fingerprint(der):
+    return hashlib.sha256(der).hexdigest()
+
+def ensure_certificate(home=HOME):
+    """Paths of this installation's certificate and key, created if missing."""
+    cert = os.path.join(home, "cert.pem")
+    key = os.path.join(home, "key.pem")
+    if not (os.path.exists(cert) and os.path.exists(key)):
+        os.makedirs(home, exist_ok=True)
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                        "-nodes", "-keyout", key, "-out", cert, "-days", "3650", "-subj", "/CN=lanchat"],
+                       check=True, capture_output=True)
+        os.chmod(key, 0o600)
+    return cert, key
+
+class TLSContext:
+    """Certificate, SSL contexts, pinned peer fingerprints and cached sessions."""
+    def __init__(self, home=HOME):
+        cert, key = ensure_certificate(home)
+        with open(cert) as f:
+            self.fingerprint = fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+        self.server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.server_ctx.load_cert_chain(cert, key)
+        self.client_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        # certificates are self-signed; peers are authenticated by their pinned fingerprint instead
+        self.client_ctx.check_hostname = False
+        self.client_ctx.verify_mode = ssl.CERT_NONE
+        for ctx in (self.server_ctx, self.client_ctx):
+            ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+            # lets OpenSSL hand record encryption to the kernel where supported (Python 3.12+)
+            ctx.options |= getattr(ssl, "OP_ENABLE_KTLS", 0)
+        self.pins_path = os.path.join(home, "known_peers.json")
+        self.pins = {}  # ip -> fingerprint
+        if os.path.exists(self.pins_path):
+            with open(self.pins_path) as f:
+                self.pins = json.load(f)
+        self.sessions = {}  # (ip, port) -> ssl.SSLSession
+        self.lock = threading.Lock()
+
+    def pinned(self, ip):
+        return self.pins.get(ip)
+
+    def pin(self, ip, fp):
+        """
+        Trust fp for ip if nothing is pinned yet. Returns True if it was newly
+        pinned, False if it was already; raises FingerprintMismatch otherwise.
+        """
+        with self.lock:
+            old = self.pins.get(ip)
+            if old == fp:
+                return False
+            if old is not None:
+                raise FingerprintMismatch(ip, old, fp)
+            self.pins[ip] = fp
+            tmp = self.pins_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.pins, f, indent=1)
+            os.replace(tmp, self.pins_path)
+            return True
+
+    def accept(self, conn):
+        """Server side: wrap conn if the client opened with a TLS handshake."""
+        try:
+            first = conn.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return conn
+        if first != HANDSHAKE:
+            return conn
+        conn = self.server_ctx.wrap_socket(conn, server_side=True)
+        metrics.inc("tls_handshakes_total", side="server", resumed=str(conn.session_reused).lower())
+        return conn
+
+    def wrap(self, sock, ip, port):
+        """
+        Client side: handshake on a connected socket, resuming the cached
+        session for the peer, and check the certificate against its pin.
+        """
+        with self.lock:
+            session = self.sessions.get((ip, int(port)))
+        s = self.client_ctx.wrap_socket(sock, session=session)
+        metrics.inc("tls_handshakes_total", side="client", resumed=str(s.session_reused).lower())
+        try:
+            self.pin(ip, fingerprint(s.getpeercert(binary_form=True)))
+        except FingerprintMismatch:
+            with self.lock:
+                self.sessions.pop((ip, int(port)), None)
+            s.close()
+            raise
+        return s
+
+    def save_session(self, s, ip, port):
+        """
+        Cache the session of s for resumption. TLS 1.3 tickets arrive after
+        the handshake, so call this once a reply has been read.
+        """
+        if isinstance(s, ssl.SSLSocket) and s.session is not None and s.session.has_ticket:
+            with self.lock:
+                self.sessions[(ip, int(port))] = s.session
+
+def from_env():
+    """A TLSContext if LANCHAT_TLS is set to a true value, else None."""
+    if os.environ.get("LANCHAT_TLS", "").lower() in ("1", "true", "yes", "on"):
+        return TLSContext()
+    return None
@@ -0,0 +1,505 @@
+"""
+One transport engine shared by both windows.
+
+Transport owns discovery, the listeners of the local profiles and a pool of
+persistent outgoing connections. It remembers which wire format every
+discovered peer speaks and encodes with the matching adapter from
+protocol.py, so callers only ever deal with (ip, port, name) peers and the
+transfer path exists once.
+
+With a tls.TLSContext, lanchat/2 peers whose certificate fingerprint is
+pinned are always spoken to over TLS; pins come from discovery or the first
+TLS connection.
+
+With an outbox.Outbox, queue_text stores messages before sending them and
+keeps them until the peer acknowledged them; whatever is still waiting is
+sent in batches when discovery next hears the peer, also after a restart.
+"""
+import os, queue, select, socket, ssl, sys, threading, time, traceback
+from concurrent.futures import Future
+from .network import (DiscoveryThread, TCPServerThread, SharedListener, PeerBusy, connect, request, retry_busy,
+                      stream_file)
+from .protocol import (DISCOVERY_PORT, LEGACY_DISCOVERY_PORT, SHARED_PORT, PROTO_V2, PROTO_APP1,
+                       PROTO_LEGACY, PROTO_RANK, encode_hello, encode_text, encode_file_header)
+from .tls import FingerprintMismatch
+from . import metrics, outbox as outbox_store
+
+IDLE_CLOSE = 60.0        # drop pooled connections idle this long, before the server's idle_timeout does
+# Seconds a lone queued message may wait for others to share its write. Bursts
+# coalesce anyway while the previous write is in flight, and timed waits wake
+# ~0.1 ms late on common kernels, so by default the writer never waits.
+FLUSH_DEADLINE = 0.0
+MAX_BATCH = 256 * 1024   # bytes coalesced into one write; 0 writes every message on its own
+IOV_MAX = 1024           # buffers per sendmsg call
+
+def _open_connection(ip, port, name, proto, tls, from_name, timeout=5):
+    """Connected socket to a peer; lanchat/2 peers are greeted and must admit us first."""
+    s = connect(ip, port, timeout)
+    try:
+        if tls:
+            s = tls.wrap(s, ip, port)
+        if proto == PROTO_V2:
+            request(s, encode_hello(from_name, name), f"{ip}:{port}", "hello")
+        if tls:
+            tls.save_session(s, ip, port)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+def _sendmsg_all(sock, bufs):
+    """sendall for a list of buffers: one writev per IOV_MAX buffers, resumed after partial writes."""
+    bufs = [memoryview(b) for b in bufs]
+    i = 0
+    while i < len(bufs):
+        sent = sock.sendmsg(bufs[i:i + IOV_MAX])
+        metrics.inc("socket_writes_total")
+        while sent and sent >= len(bufs[i]):
+            sent -= len(bufs[i])
+            i += 1
+        if sent:
+            bufs[i] = bufs[i][sent:]
+
+class PeerConnection:
+    """
+    Outgoing connection for chat messages to one peer, reused across messages.
+    send() only queues; a writer thread drains the queue and writes a burst
+    of messages with a single sendmsg (writev) call: whatever queued up while
+    the previous write was in flight, up to MAX_BATCH bytes. A message that
+    finds the queue empty waits at most FLUSH_DEADLINE for company, so single
+    messages stay fast and pasted or scripted bursts cost one syscall per batch.
+    """
+    def __init__(self, ip, port, name, proto, tls=None):
+        self.ip = ip
+        self.port = int(port)
+        self.name = name
+        self.proto = proto
+        self.tls = tls
+        self.peer = f"{ip}:{port}"
+        self.sock = None
+        self.last_used = 0.0
+        # lanchat/2 reads any number of lines per write; older receivers get one message per write
+        self.coalesce = proto == PROTO_V2
+        self.outbox = queue.Queue()  # (line, from_name, kind, future), or None to close
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def _alive(self):
+        if self.sock is None:
+            return False
+        if time.time() - self.last_used > IDLE_CLOSE:
+            self._close_sock()
+            return False
+        # a peer that closed the connection shows up as readable with no data;
+        # over TLS anything readable here is a close_notify, so peek below the record layer
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable and (self.tls or not socket.socket.recv(self.sock, 1, socket.MSG_PEEK)):
+                self._close_sock()
+                return False
+        except OSError:
+            self._close_sock()
+            return False
+        return True
+
+    def _open(self, from_name):
+        self.sock = _open_connection(self.ip, self.port, self.name, self.proto, self.tls, from_name)
+
+    def send(self, line, from_name, kind="text"):
+        """Queue line for the peer. Returns a Future that resolves once it was written."""
+        fut = Future()
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, daemon=True,
+                                               name=f"writer-{self.peer}")
+                self.writer.start()
+            self.outbox.put((line, from_name, kind, fut))
+        return fut
+
+    def _write_loop(self):
+        while True:
+            try:
+                item = self.outbox.get(timeout=IDLE_CLOSE)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                batch, closing = self._collect(item)
+                self._flush(batch)
+                if not closing:
+                    continue
+            # idle or closed: let the thread go unless more was queued meanwhile; send() starts a new one
+            with self.lock:
+                self._close_sock()
+                if self.outbox.empty():
+                    self.writer = None
+                    return
+
+    def _collect(self, first):
+        """The first message plus whatever joins it within the limits; and whether close() came next."""
+        batch, size = [first], len(first[0])
+        if not self.coalesce:
+            return batch, False
+        deadline = time.perf_counter() + FLUSH_DEADLINE
+        while size < MAX_BATCH:
+            try:
+                item = self.outbox.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+                # a burst already has company; don't hold it back any longer
+                if len(batch) > 1 or remaining <= 0:
+                    break
+                try:
+                    item = self.outbox.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    def _write(self, batch):
+        if isinstance(self.sock, ssl.SSLSocket) or not hasattr(self.sock, "sendmsg"):
+            # SSLSocket and Windows sockets have no sendmsg; one joined write is still one
+            # syscall (over TLS one SSL_write, a record per 16 KiB)
+            self.sock.sendall(b"".join(item[0] for item in batch))
+            metrics.inc("socket_writes_total")
+        else:
+            _sendmsg_all(self.sock, [item[0] for item in batch])
+
+    def _flush(self, batch):
+        for attempt in (0, 1):
+            try:
+                if not self._alive():
+                    self._open(batch[0][1])
+                self._write(batch)
+                break
+            except Exception as e:
+                self._close_sock()
+                if not isinstance(e, (OSError, ValueError, PeerBusy)):
+                    # a bug, not the network: don't let it pass as a failed send
+                    metrics.inc("errors_total", where="write")
+                    print(f"Unexpected error writing to {self.peer}:", file=sys.stderr)
+                    traceback.print_exc()
+                # reconnect once if the peer went away since the liveness check
+                if attempt or not isinstance(e, OSError) or isinstance(e, FingerprintMismatch):
+                    for item in batch:
+                        item[3].set_exception(e)
+                    return
+        size = sum(len(item[0]) for item in batch)
+        metrics.inc("messages_sent_total", len(batch), kind=batch[0][2], peer=self.peer)
+        metrics.inc("bytes_sent_total", size, peer=self.peer)
+        metrics.observe("send_batch_messages", len(batch))
+        self.last_used = time.time()
+        if self.proto == PROTO_APP1:
+            # app/1 peers read a single header per connection
+            self._close_sock()
+        for item in batch:
+            item[3].set_result(None)
+
+    def _close_sock(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def close(self, timeout=None):
+        """
+        Close once the messages already queued have been written. With a
+        timeout, wait up to that long for it to happen.
+        """
+        with self.lock:
+            writer = self.writer
+            if writer is None:
+                self._close_sock()
+                return
+            self.outbox.put(None)
+        if timeout is not None:
+            writer.join(timeout)
+
+class Transport:
+    def __init__(self, incoming_queue, recv_folder, stop_event=None, limits=None, tls=None, outbox=None):
+        self.incoming_queue = incoming_queue
+        self.recv_folder = recv_folder
+        self.stop_event = stop_event or threading.Event()
+        self.limits = limits
+        self.tls = tls
+        self.outbox = outbox
+        # peers with queued messages, and whether a running flush should go round again
+        self.waiting = set(outbox.peers()) if outbox else set()
+        self.flushing = {}  # (ip, port, name) -> True if more was queued meanwhile
+        self.unreachable = set()  # peers whose last flush failed
+        self.mismatches = set()  # (ip, fingerprint) already reported
+        self.shared_listener = None
+        self.discovery = None
+        self.protos = {}  # (ip, port, name) -> wire format the peer speaks
+        self.conns = {}   # (ip, port, name) -> PeerConnection
+        self.profiles = []  # local profiles added here, stopped by close()
+        self.lock = threading.Lock()
+
+    # discovery ---------------------------------------------------------------
+    def start_discovery(self, profiles_ref, port=DISCOVERY_PORT, legacy_port=LEGACY_DISCOVERY_PORT, **kwargs):
+        self.discovery = DiscoveryThread(profiles_ref, self.incoming_queue, self.stop_event, port=port,
+                                         legacy_port=legacy_port, on_presence=self._on_presence,
+                                         fingerprint=self.tls.fingerprint if self.tls else None, **kwargs)
+        self.discovery.start()
+        return self.discovery
+
+    def _on_presence(self, ev):
+        for p in ev.get("profiles", []):
+            self.learn(ev["from"], p["port"], p.get("name"), p.get("proto", PROTO_APP1), p.get("fp"))
+            key = (ev["from"], int(p["port"]), p.get("name"))
+            if key in self.waiting:
+                self.flush(key)
+
+    def learn(self, ip, port, name, proto, fp=None):
+        """
+        Record the wire format of a peer; a better format heard later wins.
+        fp is the certificate fingerprint it announced, pinned on first use.
+        """
+        key = (ip, int(port), name)
+        pinned = fp is not None and self.tls is not None and self._pin(ip, fp)
+        with self.lock:
+            old = self.protos.get(key)
+            if old is not None and PROTO_RANK[old] >= PROTO_RANK[proto] and not pinned:
+                return
+            if old is None or PROTO_RANK[proto] > PROTO_RANK[old]:
+                self.protos[key] = proto
+            # reconnect in the new format, or over TLS
+            conn = self.conns.pop(key, None)
+        if conn:
+            conn.close()
+
+    def _pin(self, ip, fp):
+        try:
+            return self.tls.pin(ip, fp)
+        except FingerprintMismatch as e:
+            if (ip, fp) not in self.mismatches:
+                self.mismatches.add((ip, fp))
+                self.incoming_queue.put({"type": "tls_mismatch", "from": ip, "error": str(e)})
+            return False
+
+    def _tls_for(self, ip, proto):
+        # only lanchat/2 servers accept TLS, and only pinned peers announced it
+        if self.tls and proto == PROTO_V2 and self.tls.pinned(ip):
+            return self.tls
+        return None
+
+    def proto_for(self, ip, port, name):
+        # peers we never heard announce themselves are assumed current
+        return self.protos.get((ip, int(port), name), PROTO_V2)
+
+    # local profiles ----------------------------------------------------------
+    def add_profile(self, profile, shared=False, shared_port=SHARED_PORT):
+        """
+        Start receiving for profile, on its own port or on the shared
+        listener. Fills in profile["server"], ["stop"] and ["shared"].
+        """
+        if shared:
+            with self.lock:
+                if self.shared_listener is None:
+                    self.shared_listener = SharedListener(shared_port, self.incoming_queue, self.stop_event,
+                                                          self.recv_folder, self.limits, self.tls, self.outbox)
+                    self.shared_listener.start()
+            profile.update({"port": self.shared_listener.profile["port"], "shared": True,
+                            "server": self.shared_listener, "stop": self.stop_event})
+            self.shared_listener.add_profile(profile)
+        else:
+            stop_event = threading.Event()
+            server = TCPServerThread(profile, self.incoming_queue, stop_event, self.recv_folder, self.limits,
+                                     self.tls, self.outbox)
+            profile.update({"shared": False, "server": server, "stop": stop_event})
+            server.start()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def remove_profile(self, profile):
+        with self.lock:
+            if profile in self.profiles:
+                self.profiles.remove(profile)
+        if profile.get("shared"):
+            profile["server"].remove_profile(profile)
+            return
+        profile["stop"].set()
+        try:
+            # wake the accept loop so the port is released promptly
+            socket.create_connection(("127.0.0.1", int(profile["port"])), timeout=1).close()
+        except OSError:
+            pass
+
+    # sending -----------------------------------------------------------------
+    def _connection(self, ip, port, name):
+        key = (ip, int(port), name)
+        with self.lock:
+            conn = self.conns.get(key)
+            if conn is None:
+                proto = self.proto_for(ip, port, name)
+                conn = self.conns[key] = PeerConnection(ip, port, name, proto, self._tls_for(ip, proto))
+            return conn
+
+    def send_text(self, peer, from_name, content, retries=3, wait=True):
+        """
+        peer is (ip, port, profile name); the name may be None for single-profile peers.
+        Blocks until the message was written, unless wait is False: then the
+        Future from PeerConnection.send is returned right away, and messages
+        sent in quick succession share writes.
+        """
+        ip, port, name = peer
+        conn = self._connection(ip, port, name)
+        line = encode_text(conn.proto, from_name, content, name)
+        if not wait:
+            return conn.send(line, from_name)
+        retry_busy(lambda: conn.send(line, from_name).result(), retries)
+
+    def queue_text(self, peer, from_name, content):
+        """
+        Store a message in the outbox and deliver it in the background;
+        returns its id. Messages to a peer that can't be reached stay queued
+        until discovery hears it again. Events: {"type":"delivered"} once
+        the peer acknowledged messages, {"type":"queued"} when it becomes
+        unreachable with messages waiting.
+        """
+        ip, port, name = peer
+        key = (ip, int(port), name)
+        msg_id = self.outbox.add(key, from_name, content)
+        with self.lock:
+            self.waiting.add(key)
+            # after a failed flush, wait for discovery rather than retry per message
+            retry = key not in self.unreachable
+        if retry:
+            self.flush(key)
+        return msg_id
+
+    def flush(self, peer):
+        """Send the messages queued for peer, unless a flush for it is running already."""
+        with self.lock:
+            if peer in self.flushing:
+                self.flushing[peer] = True
+                return
+            self.flushing[peer] = False
+        threading.Thread(target=self._flush_loop, args=(peer,), daemon=True,
+                         name=f"flush-{peer[0]}:{peer[1]}").start()
+
+    def _flush_loop(self, peer):
+        while True:
+            delivered, error = self._deliver(peer)
+            with self.lock:
+                again = self.flushing[peer] and error is None
+                if not again:
+                    del self.flushing[peer]
+                    if error is None:
+                        self.waiting.discard(peer)
+                was_unreachable = peer in self.unreachable
+                if error is not None:
+                    self.unreachable.add(peer)
+                else:
+                    self.unreachable.discard(peer)
+            if delivered:
+                self.incoming_queue.put({"type": "delivered", "peer": peer, "count": delivered,
+                                         "backlog": was_unreachable})
+            if error is not None and not was_unreachable:
+                try:
+                    pending = self.outbox.count(peer)
+                except Exception:
+                    pending = None
+                self.incoming_queue.put({"type": "queued", "peer": peer, "pending": pending, "error": str(error)})
+            if not again:
+                return
+
+    def _deliver(self, peer):
+        """
+        Send everything queued for peer, oldest first, a batch per write.
+        lanchat/2 peers confirm each batch with the reply to a hello sent
+        after it; older ones have no replies, so a completed write counts.
+        Returns (messages delivered, the error that stopped it or None).
+        """
+        ip, port, name = peer
+        proto = self.proto_for(ip, port, name)
+        addr = f"{ip}:{port}"
+        delivered = 0
+        s = None
+        try:
+            while True:
+                rows = self.outbox.pending(peer, outbox_store.BATCH)
+                if not rows:
+                    return delivered, None
+                if proto != PROTO_V2:
+                    for seq, msg_id, from_name, content in rows:
+                        self.send_text(peer, from_name, content)
+                        self.outbox.ack(peer, seq)
+                        delivered += 1
+                    continue
+                from_name = rows[-1][2]
+                if s is None:
+                    s = _open_connection(ip, port, name, proto, self._tls_for(ip, proto), from_name)
+                batch = b"".join(encode_text(proto, f, content, name, msg_id) for _, msg_id, f, content in rows)
+                s.sendall(batch)
+                metrics.inc("messages_sent_total", len(rows), kind="text", peer=addr)
+                metrics.inc("bytes_sent_total", len(batch), peer=addr)
+                # the reply comes after every line before it was handled: one ack for the batch
+                request(s, encode_hello(from_name, name), addr, "hello")
+                delivered += self.outbox.ack(peer, rows[-1][0])
+                metrics.inc("outbox_delivered_total", len(rows), peer=addr)
+        except Exception as e:
+            return delivered, e
+        finally:
+            if s is not None:
+                s.close()
+
+    def send_file(self, peer, from_name, file_path, progress_callback=None, retries=3, compress=False, verify=False):
+        """
+        Send a file on a connection of its own, so chat keeps flowing on the
+        pooled one. lanchat/2 peers admit the transfer first and may ask us
+        to retry later; older peers just receive the header and the bytes.
+        compress / verify send it zlib-compressed / with per-chunk SHA-256
+        through pipeline.py, if the peer accepts that.
+        """
+        ip, port, name = peer
+        proto = self.proto_for(ip, port, name)
+        tls = self._tls_for(ip, proto)
+        fname = os.path.basename(file_path)
+        total = os.path.getsize(file_path)
+        offer = ("zlib" if compress else "none" if verify else None) if proto == PROTO_V2 else None
+        line = encode_file_header(proto, from_name, fname, total, name, ack=proto == PROTO_V2, codec=offer)
+        addr = f"{ip}:{port}"
+        codec = None
+        def open_transfer():
+            nonlocal codec
+            s = connect(ip, port, 10)
+            try:
+                if tls:
+                    s = tls.wrap(s, ip, port)
+                if proto == PROTO_V2:
+                    reply = request(s, line, addr, "file")
+                    codec = offer if offer and reply.get("pipeline") == offer else None
+                    if tls:
+                        tls.save_session(s, ip, port)
+                else:
+                    s.sendall(line)
+                    metrics.inc("messages_sent_total", kind="file", peer=addr)
+            except Exception:
+                s.close()
+                raise
+            return s
+        s = retry_busy(open_transfer, retries)
+        try:
+            return stream_file(s, file_path, addr, progress_callback, codec)
+        finally:
+            s.close()
+
+    def close(self):
+        """
+        Stop discovery and the local profiles' listeners, flush and close
+        outgoing connections. The outbox stays open; it belongs to the caller.
+        """
+        self.stop_event.set()
+        with self.lock:
+            conns = list(self.conns.values())
+            self.conns.clear()
+            for profile in self.profiles:
+                profile["stop"].set()
+        for conn in conns:
+            conn.close(timeout=5)
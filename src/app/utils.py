@@ -1,4 +1,7 @@
-import socket
+import os, socket
+
+# per-user state: TLS identity, pinned peers, caches
+APP_HOME = os.environ.get("LANCHAT_HOME") or os.path.join(os.path.expanduser("~"), ".lanchat")
 
 def get_local_ip():
     """
@@ -14,4 +17,7 @@ def get_local_ip():
         ip = "127.0.0.1"
     finally:
         s.close()
-    return ip
\ No newline at end of file
+    return ip
+
+def ensure_dir(d):
+    os.makedirs(d, exist_ok=True)
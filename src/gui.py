@@ -1,8 +1,11 @@
 from PySide6 import QtCore, QtGui, QtWidgets
 import sys, os, threading
-from network import PeerDiscovery, TCPServer, PeerClient, handle_incoming_connection
 from queue import Queue, Empty
-from utils import ensure_dir, make_message_json
+from app.transport import Transport
+from app.utils import ensure_dir, get_local_ip
+from app import metrics
+from app.outbox import Outbox
+from app.preview_view import InlinePreviews
 import json, time
 
 class WorkerSignals(QtCore.QObject):
@@ -11,7 +14,7 @@ class WorkerSignals(QtCore.QObject):
     file_received = QtCore.Signal(dict)
 
 class ChatWindow(QtWidgets.QWidget):
-    def __init__(self, username='Peer', tcp_port=5001, save_dir='received_files'):
+    def __init__(self, username='Peer', tcp_port=5001, save_dir='received_files', tls=None):
         super().__init__()
         self.setWindowTitle(f'LAN Chat - {username}')
         self.setMinimumSize(900,600)
@@ -23,19 +26,21 @@ class ChatWindow(QtWidgets.QWidget):
         # networking
         self.stop_event = threading.Event()
         self.incoming_queue = Queue()
-        self.peers = {}  # (ip,port) -> name
-        self.clients = {}  # (ip,port) -> PeerClient
+        metrics.gauge_fn('incoming_queue_depth', self.incoming_queue.qsize)
+        self.peers = {}  # (ip,port,name) -> name
+        self.local_ips = {'127.0.0.1', get_local_ip()}
 
         self.signals = WorkerSignals()
         self.signals.peer_discovered.connect(self._on_peer_discovered)
         self.signals.message_received.connect(self._on_message_received)
         self.signals.file_received.connect(self._on_file_received)
 
-        # start discovery & server
-        self.discovery = PeerDiscovery(self.username, self.tcp_port, lambda ip,port,name: self.signals.peer_discovered.emit(ip,port,name), self.stop_event)
-        self.discovery.start()
-        self.server = TCPServer('0.0.0.0', self.tcp_port, lambda conn,addr: threading.Thread(target=handle_incoming_connection, args=(conn,addr,self.incoming_queue,self.save_dir), daemon=True).start(), self.stop_event)
-        self.server.start()
+        # start discovery & server (shared engine with the profile-based window)
+        self.outbox = Outbox()
+        metrics.gauge_fn('outbox_pending', self.outbox.count)
+        self.transport = Transport(self.incoming_queue, self.save_dir, self.stop_event, tls=tls, outbox=self.outbox)
+        self.profile = self.transport.add_profile({'name': self.username, 'port': self.tcp_port})
+        self.transport.start_discovery(lambda: [self.profile])
 
         # Thread: monitor incoming_queue and emit signals
         threading.Thread(target=self._incoming_monitor, daemon=True).start()
@@ -44,18 +49,34 @@ class ChatWindow(QtWidgets.QWidget):
         self._apply_styles()
 
     def closeEvent(self, event):
-        self.stop_event.set()
+        self.profile['stop'].set()
+        self.transport.close()
+        self.outbox.close()
+        self.previews.shutdown()
         event.accept()
 
     def _incoming_monitor(self):
         while not self.stop_event.is_set():
             try:
-                pkg = self.incoming_queue.get(timeout=0.5)
-                kind = pkg.get('kind')
-                if kind == 'file-received':
-                    self.signals.file_received.emit(pkg)
-                else:
-                    self.signals.message_received.emit(pkg)
+                ev = self.incoming_queue.get(timeout=0.5)
+                kind = ev.get('type')
+                if kind == 'presence':
+                    for p in ev.get('profiles', []):
+                        if ev['from'] in self.local_ips and p.get('port') == self.tcp_port:
+                            continue
+                        self.signals.peer_discovered.emit(ev['from'], int(p['port']), p.get('name') or '?')
+                elif kind == 'file':
+                    self.signals.file_received.emit(ev)
+                elif kind == 'message':
+                    self.signals.message_received.emit(ev)
+                elif kind == 'tls_mismatch':
+                    self.signals.message_received.emit({'from': 'system', 'content': ev['error']})
+                elif kind == 'queued':
+                    self.signals.message_received.emit({'from': 'system', 'content':
+                        f"{ev['peer'][0]}:{ev['peer'][1]} unreachable; {ev.get('pending')} message(s) queued"})
+                elif kind == 'delivered' and ev.get('backlog'):
+                    self.signals.message_received.emit({'from': 'system', 'content':
+                        f"Delivered {ev['count']} queued message(s) to {ev['peer'][0]}:{ev['peer'][1]}"})
             except Empty:
                 continue
 
@@ -85,6 +106,8 @@ class ChatWindow(QtWidgets.QWidget):
         self.chat_view.setReadOnly(True)
         self.chat_view.setAcceptDrops(False)
         center_layout.addWidget(self.chat_view)
+        # thumbnails of received files, generated off the GUI thread
+        self.previews = InlinePreviews(self.chat_view)
         # input row
         row = QtWidgets.QHBoxLayout()
         self.input_line = QtWidgets.QLineEdit()
@@ -139,48 +162,44 @@ class ChatWindow(QtWidgets.QWidget):
                 self.send_file_to_selected(path)
 
     def _on_peer_discovered(self, ip, port, name):
-        key = (ip,port)
+        # profiles sharing one listener announce the same (ip, port); the name tells them apart
+        key = (ip,port,name)
         if key not in self.peers:
             self.peers[key] = name
-            self.peer_list.addItem(f'{name} — {ip}:{port}')
+            item = QtWidgets.QListWidgetItem(f'{name} — {ip}:{port}')
+            item.setData(QtCore.Qt.UserRole, key)
+            self.peer_list.addItem(item)
             self.status_area.append(f'Discovered {name} @ {ip}:{port}')
 
+    def _selected_peer(self):
+        sel = self.peer_list.currentItem()
+        if not sel:
+            return None
+        return tuple(sel.data(QtCore.Qt.UserRole))
+
     def connect_to_selected_peer(self, item):
-        txt = item.text()
-        # parse ip and port
-        try:
-            parts = txt.split('—')[-1].strip()
-            host, port = parts.split(':')
-            host = host.strip()
-            port = int(port.strip())
-            key = (host,port)
-            if key in self.clients:
-                self.status_area.append('Already connected.')
-                return
-            client = PeerClient(host, port, self.incoming_queue)
-            self.clients[key] = client
-            self.status_area.append(f'Connected to {host}:{port}')
-        except Exception as e:
-            self.status_area.append('Failed to connect: '+str(e))
+        # connections are opened on first use and kept by the transport
+        peer = self._selected_peer()
+        if peer:
+            self.status_area.append(f'Using {peer[0]}:{peer[1]} ({self.transport.proto_for(*peer)})')
+
+    def _send_in_background(self, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except Exception as e:
+                self.signals.message_received.emit({'from': 'system', 'content': f'Send failed: {e}'})
+        threading.Thread(target=run, daemon=True).start()
 
     def send_message(self):
         txt = self.input_line.text().strip()
         if not txt:
             return
-        sel = self.peer_list.currentItem()
-        if not sel:
+        peer = self._selected_peer()
+        if not peer:
             self.status_area.append('Select a peer to send to (double-click to connect).')
             return
-        parts = sel.text().split('—')[-1].strip()
-        host,port = parts.split(':')
-        key = (host.strip(),int(port.strip()))
-        client = self.clients.get(key)
-        if not client:
-            # attempt to connect automatically
-            client = PeerClient(host.strip(), int(port.strip()), self.incoming_queue)
-            self.clients[key] = client
-        payload = {'from':self.username,'text':txt}
-        client.send_message('chat', payload)
+        self._send_in_background(self.transport.queue_text, peer, self.username, txt)
         self._append_chat_line(self.username, txt)
         self.input_line.clear()
 
@@ -188,11 +207,8 @@ class ChatWindow(QtWidgets.QWidget):
         t = time.strftime('%H:%M:%S', time.localtime())
         self.chat_view.append(f'<b>{who}</b> <span style="color:gray">[{t}]</span>: {QtWidgets.QTextDocument().toPlainText() if False else text}')
 
-    def _on_message_received(self, pkg):
-        payload = pkg.get('payload',{})
-        who = payload.get('from','?')
-        text = payload.get('text','')
-        self._append_chat_line(who, text)
+    def _on_message_received(self, ev):
+        self._append_chat_line(ev.get('from') or '?', ev.get('content') or '')
 
     def select_and_send_file(self):
         sel = self.peer_list.currentItem()
@@ -204,21 +220,12 @@ class ChatWindow(QtWidgets.QWidget):
             self.send_file_to_selected(path)
 
     def send_file_to_selected(self, path):
-        sel = self.peer_list.currentItem()
-        if not sel:
+        peer = self._selected_peer()
+        if not peer:
             self.status_area.append('Select a peer to send to (double-click to connect).')
             return
-        parts = sel.text().split('—')[-1].strip()
-        host,port = parts.split(':')
-        key = (host.strip(),int(port.strip()))
-        client = self.clients.get(key)
-        if not client:
-            client = PeerClient(host.strip(), int(port.strip()), self.incoming_queue)
-            self.clients[key] = client
-            # small wait could be necessary for connection -- in production you'd have better connect management
-            QtCore.QTimer.singleShot(400, lambda: client.send_file(path))
-        else:
-            QtCore.QTimer.singleShot(0, lambda: client.send_file(path))
+        host, port, _ = peer
+        self._send_in_background(self.transport.send_file, peer, self.username, path)
         self.transfers.addItem(f'Sending: {os.path.basename(path)} -> {host}:{port}')
         self.status_area.append(f'Started sending {path} to {host}:{port}')
 
@@ -227,6 +234,8 @@ class ChatWindow(QtWidgets.QWidget):
         size = info.get('size')
         fr = info.get('from')
         self.transfers.addItem(f'Received: {fname} ({size} bytes) from {fr}')
-        self.status_area.append(f'File saved to {os.path.join(self.save_dir, fname)}')
+        self.status_area.append(f"File saved to {info.get('path')}")
+        self._append_chat_line(fr or '?', f'sent {fname}')
+        self.previews.add(info.get('path'))
 
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import argparse
 from gui import ChatWindow
+from app import metrics, tls
 from PySide6.QtWidgets import QApplication
 import sys
 
@@ -9,10 +10,15 @@ def main():
     parser.add_argument('--name', required=False, default='Peer', help='Display name for this instance')
     parser.add_argument('--port', required=False, type=int, default=5001, help='TCP port for incoming connections')
     parser.add_argument('--save-dir', required=False, default='received_files', help='Directory to save incoming files')
+    parser.add_argument('--metrics-port', required=False, type=int, default=None, help='Serve Prometheus metrics on 127.0.0.1:PORT (/metrics, /metrics.json)')
+    parser.add_argument('--tls', action='store_true', help='Encrypt connections to peers that support it (also LANCHAT_TLS=1)')
     args = parser.parse_args()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
 
     app = QApplication([])
-    window = ChatWindow(username=args.name, tcp_port=args.port, save_dir=args.save_dir)
+    window = ChatWindow(username=args.name, tcp_port=args.port, save_dir=args.save_dir,
+                        tls=tls.TLSContext() if args.tls else tls.from_env())
     window.show()
     sys.exit(app.exec())
 